@@ -443,7 +443,7 @@ class VGGActivationNormNetwork(nn.Module):
 
             out = F.max_pool2d(input=out, kernel_size=2, stride=2, padding=0)
 
-        out = out.view((out.shape[0], -1))
+        out = out.reshape((out.shape[0], -1))
 
         if type(self.num_output_classes) == list:
             for idx, num_output_classes in enumerate(self.num_output_classes):
@@ -502,7 +502,7 @@ class VGGActivationNormNetwork(nn.Module):
 
         features = out
 
-        out = out.view(out.size(0), -1)
+        out = out.reshape(out.size(0), -1)
 
         if type(self.num_output_classes) == list:
             pred_list = []
@@ -578,7 +578,7 @@ class FCCActivationNormNetwork(nn.Module):
         """
         x = torch.zeros(self.input_shape)
         out = x
-        out = out.view(out.size(0), -1)
+        out = out.reshape(out.size(0), -1)
         self.layer_dict = nn.ModuleDict()
 
         for i in range(self.num_stages):
@@ -589,7 +589,7 @@ class FCCActivationNormNetwork(nn.Module):
                 out = self.layer_dict['fcc_bn_{}'.format(i)].forward(out, num_step=0)
             out = F.leaky_relu(out)
 
-        out = out.view(out.shape[0], -1)
+        out = out.reshape(out.shape[0], -1)
 
         self.layer_dict['preds_linear'] = MetaLinearLayer(input_shape=(out.shape[0], np.prod(out.shape[1:])),
                                                           num_filters=self.num_output_classes, use_bias=self.use_bias)
@@ -623,7 +623,7 @@ class FCCActivationNormNetwork(nn.Module):
                 param_dict[layer_name] = None
 
         out = x
-        out = out.view(out.size(0), -1)
+        out = out.reshape(out.size(0), -1)
         for i in range(self.num_stages):
             out = self.layer_dict['fcc_{}'.format(i)](out, params=param_dict['fcc_{}'.format(i)])
             if self.use_bn:
@@ -633,7 +633,7 @@ class FCCActivationNormNetwork(nn.Module):
             out = F.leaky_relu(out)
             features = out
 
-        out = out.view(out.size(0), -1)
+        out = out.reshape(out.size(0), -1)
         out = self.layer_dict['preds_linear'](out, param_dict['preds_linear'])
 
         if return_features:
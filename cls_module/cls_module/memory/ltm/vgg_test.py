@@ -0,0 +1,45 @@
+"""vgg_test.py"""
+
+import torch
+
+from cls_module.memory.ltm.vgg import VGG
+
+config = {
+    "learning_rate": 0.001,
+    "weight_decay": 0.0001,
+    "num_stages": 2,
+    "num_filters": 48,
+    "use_channel_wise_attention": True,
+    "kernel_size": 3,
+    "stride": 1,
+    "eval_stride": 1,
+    "classifier": {
+        "output_units": [20]
+    }
+}
+
+# Same input shape as the Schapiro configurations
+input_shape = [1, 1, 52, 52]
+
+torch.manual_seed(0)
+
+vgg = VGG(config=config, input_shape=input_shape)
+
+x = torch.rand(8, *input_shape[1:])
+labels = torch.arange(8)
+x_channels_last = x.to(memory_format=torch.channels_last)
+
+# Verify that a channels_last batch gives the same encoding and predictions as a contiguous one
+vgg.eval()
+with torch.no_grad():
+  _, outputs = vgg(x, targets=x, labels=labels)
+  _, outputs_channels_last = vgg(x_channels_last, targets=x_channels_last, labels=labels)
+
+torch.testing.assert_allclose(outputs_channels_last['memory']['output'], outputs['memory']['output'], rtol=1e-4, atol=1e-4)
+torch.testing.assert_allclose(outputs_channels_last['memory']['predictions'], outputs['memory']['predictions'],
+                              rtol=1e-4, atol=1e-4)
+
+# Verify that a pretraining step runs on a channels_last batch
+vgg.train()
+losses, _ = vgg(x_channels_last, targets=x_channels_last, labels=labels)
+assert torch.isfinite(losses['memory']['loss'])
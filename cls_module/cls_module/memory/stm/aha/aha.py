@@ -119,7 +119,7 @@ class AHA(MemoryInterface):
     outputs['ec_in'] = inputs
 
     outputs['dg'] = self.dg(normed_inputs)
-    features['dg'] = outputs['dg'].detach().cpu()
+    features['dg'] = outputs['dg'].detach()
 
     # Compute DG Overlap
     overlap = self.dg.compute_overlap(outputs['dg'])
@@ -133,16 +133,16 @@ class AHA(MemoryInterface):
       ca3_cue, losses['dg_ca3'], losses['ec_ca3'], losses['ca3_cue'] = self.perforant(ec_inputs=normed_inputs, dg_inputs=outputs['dg'])
 
       outputs['ec_ca3'] = {
-        'ca3_cue': ca3_cue.detach().cpu()
+        'ca3_cue': ca3_cue.detach()
       }
 
-      features['ca3_cue'] = ca3_cue.detach().cpu()
+      features['ca3_cue'] = ca3_cue.detach()
 
     # Perforant Pathway: Error-Driven Learning
     else:
       pr_targets = outputs['dg'] if self.training else self.stored_ca3_cue
       losses['pr'], outputs['pr'] = self.perforant(inputs=normed_inputs, targets=pr_targets)
-      features['pr'] = outputs['pr']['pr_out'].detach().cpu()
+      features['pr'] = outputs['pr']['pr_out'].detach()
 
       # Compute PR Mismatch
       pr_out = outputs['pr']['pr_out']
@@ -157,7 +157,7 @@ class AHA(MemoryInterface):
 
     # CA3
     outputs['ca3'] = self.ca3(inputs=ca3_cue)
-    features['ca3'] = outputs['ca3'].detach().cpu()
+    features['ca3'] = outputs['ca3'].detach()
 
     outputs['encoding'] = outputs['ca3'].detach()
     outputs['output'] = outputs['ca3'].detach()
@@ -172,17 +172,18 @@ class AHA(MemoryInterface):
       features['recon'] = None
 
       outputs['decoding_ec'] = outputs['ca1']['decoding'].detach()
-      features['recon_ec'] =  outputs['ca1']['decoding'].detach().cpu()
+      features['recon_ec'] = outputs['ca1']['decoding'].detach()
     else:
       losses['pm'], outputs['pm'] = self.pm(inputs=outputs['ca3'], targets=targets)
       losses['pm_ec'], outputs['pm_ec'] = self.pm_ec(inputs=outputs['ca3'], targets=inputs)
 
       outputs['decoding'] = outputs['pm']['decoding'].detach()
-      features['recon'] = outputs['pm']['decoding'].detach().cpu()
+      features['recon'] = outputs['pm']['decoding'].detach()
 
       outputs['decoding_ec'] = outputs['pm_ec']['decoding'].detach()
-      features['recon_ec'] =  outputs['pm_ec']['decoding'].detach().cpu()
+      features['recon_ec'] = outputs['pm_ec']['decoding'].detach()
 
+    # Features stay on the device; readers copy them to the host when they need them
     self.features = features
 
     return losses, outputs
@@ -1,10 +1,9 @@
-import csv
 import os
-import re
 import string
 import matplotlib.pyplot as plt
 import numpy as np
 import collections
+from concurrent.futures import ThreadPoolExecutor
 
 import seaborn as sns
 import pandas as pd
@@ -20,29 +19,45 @@ COMPONENT_NAME_MAP = {
   "recon_pair": "Reconstruction"
 }
 
+
+def _list_csv_files(path):
+    """Map the stem of every CSV file in `path` to its filename, listing the directory only once."""
+    return {os.path.splitext(file)[0]: file for file in os.listdir(path) if file.endswith('.csv')}
+
+
+def _load_csv(path, filename):
+    """Load a CSV of results, caching the parsed array in a .npy file next to it for later runs."""
+    csv_path = os.path.join(path, filename)
+    npy_path = os.path.splitext(csv_path)[0] + '.npy'
+
+    # Only trust the cache if it is at least as recent as the CSV it was parsed from
+    if os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(csv_path):
+        return np.load(npy_path)
+
+    data = pd.read_csv(csv_path, header=None, dtype=np.float32, engine='c').to_numpy()
+    np.save(npy_path, data)
+
+    return data
+
+
 class HeatmapPlotter:
     def __init__(self, path, component, label):
         self.path = path
         self.component = component
         self.label = label
         self.community = "community" in path
+        self._by_stem = _list_csv_files(path)
 
     # Function to load results in Runs
     def _load_predictions_pearson(self):
-        name = self.label + '.csv$'
-        response = [file for file in os.listdir(self.path) if re.match(name, file)]
-        with open(os.path.join(self.path, response[0]), newline='') as f:
-            reader = csv.reader(f)
-            data = list(reader)
-            data = [list(map(float, a)) for a in data]
-            data = np.stack(data, axis=0)
+        data = _load_csv(self.path, self._by_stem[self.label])
 
         return data
 
     def create_heatmap(self):
         data = self._load_predictions_pearson()
 
-        labels = [list(string.ascii_uppercase)[a] for a in range(data.__len__())]
+        labels = list(string.ascii_uppercase[:data.shape[0]])
         plt.figure()
         ax = plt.axes()
 
@@ -56,28 +71,21 @@ class HeatmapPlotter:
         ax.set_title(COMPONENT_NAME_MAP[self.component])
         figure = r_heatmap.get_figure()
         figure.savefig(os.path.join(self.path, self.label + '.png'), dpi=300)
-        plt.close()
+        plt.close(figure)
 
 
 class BarPlotter:
     def __init__(self, path, components):
         self.path = path
         self.components = components
+        self._by_stem = _list_csv_files(path)
 
     def _load_predictions_pearson(self, component):
-        name = component + '.*?csv$'
-        response = [file for file in os.listdir(self.path) if re.match(name, file)]
-        with open(os.path.join(self.path, response[0]), newline='') as f:
-            reader = csv.reader(f)
-            data = list(reader)
-            data = [list(map(float, a)) for a in data]
-            data = np.stack(data, axis=0)
+        data = _load_csv(self.path, self._by_stem[component])
 
         return data
 
     def create_bar(self):
-        df = pd.DataFrame({'A': [], 'B': [], 'C': []})
-
         if 'pairs_structure' in self.path:
              labels = ['Early \npair', 'Early \nshuffled', 'Late \npair', 'Late \nshuffled']
         if 'associative_inference' in self.path:
@@ -88,37 +96,38 @@ class BarPlotter:
                       'Late \nwithin internal', 'Late \nwithin boundary',
                       'Late \nacross boundary', 'Late \nacross other']
 
-        for a in self.components:
-            data_early = self._load_predictions_pearson("pearson_early_test_" + a)
-
-            tmp_df_A = pd.DataFrame({'A': data_early[:, 0], 'B': labels[0]})
-            tmp_df_B = pd.DataFrame({'A': data_early[:, 1], 'B': labels[1]})
+        # Number of pattern types (columns) per CSV; the first half of labels is early, the second half late
+        n_cols = 4 if 'community_structure' in self.path else 2
 
-            tmp_df_ini = pd.concat([tmp_df_A, tmp_df_B])
+        components = list(self.components)
 
-            if 'community_structure' in self.path:
-                tmp_df_C = pd.DataFrame({'A': data_early[:, 2], 'B': labels[2]})
-                tmp_df_D = pd.DataFrame({'A': data_early[:, 3], 'B': labels[3]})
-                tmp_df_ini = pd.concat([tmp_df_A, tmp_df_B, tmp_df_C, tmp_df_D])
+        # Read the early/late CSVs of all components concurrently; the C parser releases the GIL
+        stems = [prefix + a for a in components for prefix in ("pearson_early_test_", "pearson_late_test_")]
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(stems)))) as executor:
+            loaded = list(executor.map(self._load_predictions_pearson, stems))
 
-            tmp_df_ini['C'] = a
+        # Blocks hold the data, the index of its first label and the index of its component
+        blocks = [(data, (i % 2) * n_cols, i // 2) for i, data in enumerate(loaded)]
 
-            data_late = self._load_predictions_pearson("pearson_late_test_" + a)
+        # Fill one array per column and build the DataFrame once, instead of growing it with pd.concat.
+        # Labels and components are filled as integer category codes rather than Python string objects.
+        total = sum(data.shape[0] * n_cols for data, _, _ in blocks)
+        values_A = np.empty(total, dtype=np.float32)
+        codes_B = np.empty(total, dtype=np.int8)
+        codes_C = np.empty(total, dtype=np.int16)
 
-            tmp_df_A = pd.DataFrame({'A': data_late[:, 0], 'B': labels[2]})
-            tmp_df_B = pd.DataFrame({'A': data_late[:, 1], 'B': labels[3]})
-            tmp_df_shu = pd.concat([tmp_df_A, tmp_df_B])
+        offset = 0
+        for data, first_label, c in blocks:
+            size = data.shape[0] * n_cols
+            # Column-major flattening lays the pattern columns out one after another in a single copy
+            values_A[offset:offset + size] = data[:, :n_cols].reshape(-1, order='F')
+            codes_B[offset:offset + size] = np.repeat(np.arange(first_label, first_label + n_cols), data.shape[0])
+            codes_C[offset:offset + size] = c
+            offset += size
 
-            if 'community_structure' in self.path:
-                tmp_df_A = pd.DataFrame({'A': data_late[:, 0], 'B': labels[4]})
-                tmp_df_B = pd.DataFrame({'A': data_late[:, 1], 'B': labels[5]})
-                tmp_df_C = pd.DataFrame({'A': data_late[:, 2], 'B': labels[6]})
-                tmp_df_D = pd.DataFrame({'A': data_late[:, 3], 'B': labels[7]})
-                tmp_df_shu = pd.concat([tmp_df_A, tmp_df_B, tmp_df_C, tmp_df_D])
-
-            tmp_df_shu['C'] = a
-
-            df = pd.concat([df, tmp_df_ini, tmp_df_shu])
+        df = pd.DataFrame({'A': values_A,
+                           'B': pd.Categorical.from_codes(codes_B, categories=labels),
+                           'C': pd.Categorical.from_codes(codes_C, categories=components)})
 
         bar_colors = ['#DBAE81', '#B29EC1', '#D17A3D', '#685CA2']
 
@@ -134,7 +143,7 @@ class BarPlotter:
         plt.ylabel("Mean correlation between \npatterns after training")
         figure = bar_plot.get_figure()
         figure.savefig(os.path.join(self.path, 'bar.png'), dpi=300)
-        plt.close()
+        plt.close(figure)
 
 class FrequencyPlotter:
     def __init__(self, path, sequence, seed_batch):
@@ -26,6 +26,10 @@ class OmniglotTransformation:
     self.invert = invert
     self.resize_factor = resize_factor
 
+  def __repr__(self):
+    return '{}(centre={}, invert={}, resize_factor={})'.format(
+        self.__class__.__name__, self.centre, self.invert, self.resize_factor)
+
   def __call__(self, x):
     # Resize
     if self.resize_factor != 1.0:
@@ -1,5 +1,9 @@
+import os
+import hashlib
+import tempfile
 from os.path import join
 from typing import List, Tuple
+import torch
 from torch.utils.data import Dataset
 from torchvision.datasets.utils import download_and_extract_archive, check_integrity, list_dir, list_files
 import numpy as np
@@ -107,3 +111,64 @@ class OmniglotAlphabet(Dataset):
             return 'images_background'
 
 
+class OmniglotAlphabetBank(Dataset):
+    """ All the images of an OmniglotAlphabet decoded once and stacked into a single (N, C, H, W) tensor, so that
+    sequences of characters can be gathered by index instead of being read and transformed one image at a time.
+
+    If a `cache_key` is given, the stacked tensors are also saved under `<root>/_cache`, keyed on the alphabet, its
+    image files and their modification times, the repr of its transform and `cache_key`, and loaded from there by
+    later runs.
+    """
+
+    def __init__(self, alphabet, cache_key=None):
+        self.cache_path = None
+        if cache_key is not None:
+            key = (alphabet.alphabet, alphabet.use_alphabet, alphabet.own_alphabet, alphabet.writer_idx,
+                   alphabet.characters, self._image_files(alphabet), repr(alphabet.transform), cache_key)
+            self.cache_path = join(alphabet.root, '_cache', hashlib.md5(repr(key).encode()).hexdigest() + '.pt')
+
+            if os.path.exists(self.cache_path):
+                self.images, self.labels = torch.load(self.cache_path)
+                return
+
+        images, labels = zip(*[alphabet[idx] for idx in range(len(alphabet))])
+        self.images = torch.stack(images, 0)
+        self.labels = torch.tensor(labels, dtype=torch.long)
+
+        if self.cache_path is not None:
+            # Write to a file unique to this process, so runs sharing the data root can't interleave their writes
+            cache_dir = os.path.dirname(self.cache_path)
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+            os.close(fd)
+            try:
+                torch.save((self.images, self.labels), tmp_path)
+                os.replace(tmp_path, self.cache_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    @staticmethod
+    def _image_files(alphabet):
+        """ The (path, modification time) of every image file the alphabet reads. """
+        character_images = alphabet.flat_character_images
+        if alphabet.variation:
+            character_images = sum(character_images, [])
+        image_paths = [join(alphabet.target_folder, alphabet.characters[character_class], image_name)
+                       for image_name, character_class in character_images]
+        return [(path, os.path.getmtime(path)) for path in image_paths]
+
+    def __len__(self):
+        return self.images.size(0)
+
+    def __getitem__(self, index):
+        return self.images[index], self.labels[index].tolist()
+
+
+def bank_alphabet(alphabet, cache_key=None):
+    """ Precompute `alphabet` into an OmniglotAlphabetBank. Alphabets with `variation` draw a random writer on every
+    access, so they are returned unchanged.
+    """
+    if alphabet.variation:
+        return alphabet
+    return OmniglotAlphabetBank(alphabet, cache_key)
@@ -1,10 +1,16 @@
 """SequenceGenerator class."""
 import numpy as np
+import torch
 from igraph import Graph
 from random import randint, choice, shuffle
 from itertools import islice
 
 
+def pair_index(pairs):
+    """Split a list of (i, j) pairs into row and column index tensors, for advanced indexing of a matrix."""
+    return tuple(torch.tensor(pairs, dtype=torch.long).reshape(-1, 2).t())
+
+
 class SequenceGenerator:
     """Create a sequences of length equal to seq_length. Pairs are formed with digits from 0 to the number specified
    by characters. From Schapiro: There were eight items (A–H) grouped into four pairs (AB, CD, EF, GH). Items within a
@@ -24,6 +30,8 @@ be CD. """
         self.core_label_sequence = self._create_label_sequence()
         self.sequence = self._create_sequence()
         self.test_sequence = self._create_test_sequence()
+        self.core_idx = pair_index(self.core_sequence)
+        self.test_idx = pair_index(self.test_sequence)
 
     def _create_core_sequence(self):
         if self.characters % 2 != 0:
@@ -88,6 +96,7 @@ class SequenceGeneratorGraph:
         self.all_pairs = [(a, b) for a in range(0, self.community_size) for b in range(0, self.community_size)]
         self.core_label_sequence, self.graph_sequences = self._create_label_sequence()
         self.sequence = self._create_sequence()
+        self.graph_idx = [pair_index(pairs) for pairs in self.graph_sequences]
 
 
     def _create_label_sequence(self):
@@ -149,6 +158,9 @@ class SequenceGeneratorTriads:
         self.core_sequence = self.core_label_sequence
         self.test_sequence = self._create_test_sequence()
         self.base_sequence = self._create_base_sequence()
+        self.core_idx = pair_index(self.core_sequence)
+        self.test_idx = pair_index(self.test_sequence)
+        self.base_idx = pair_index(self.base_sequence)
 
     def _create_label_sequence(self):
         if self.characters % 3 != 0:
@@ -1,6 +1,7 @@
 import torch.nn
 from scipy import stats
 import csv
+import utils
 
 class Correlations:
     def __init__(self, path, seed):
@@ -8,11 +9,7 @@ class Correlations:
         self.seed = seed
 
     def correlation(self, data_A, data_B, file_name):
-        data_A_flat = torch.flatten(data_A, start_dim=1)
-        data_B_flat = torch.flatten(data_B, start_dim=1)
-        correlation = [[stats.pearsonr(a, b)[0] for a in data_B_flat] for b in
-                       data_A_flat]
-        correlation = torch.tensor(correlation).numpy()
+        correlation = utils.pearson_correlation_matrix(data_A, data_B).cpu().numpy()
 
         with open(self.path + '/correlation_' + file_name + '.csv', 'w', encoding='UTF8') as f:
             writer_file = csv.writer(f)
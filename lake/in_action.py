@@ -12,6 +12,8 @@ import cv2
 import base64
 import numpy as np
 
+import utils
+
 from omniglot_one_shot_dataset import OmniglotTransformation, OmniglotOneShotDataset
 
 from cls_module.memory.ltm.visual_component import VisualComponent
@@ -134,16 +136,17 @@ if __name__ == '__main__':
                 delete_figure_agg(fagg)
             model(x[button].unsqueeze(0), label[button].unsqueeze(0), mode=mode)
             fig_agg.append(update_image(window['input'], x[button].squeeze(), 'input'))
-            for feature in model.features[mode]:
-                print(feature, model.features[mode][feature].shape)
+            features = utils.features_to_host(model.features[mode])
+            for feature in features:
+                print(feature, features[feature].shape)
                 if feature not in ['inputs', 'labels', 'ltm_vc']:
-                    if len(model.features[mode][feature].squeeze().shape)<2:
-                        size = model.features[mode][feature].squeeze().shape[0]
+                    if len(features[feature].squeeze().shape)<2:
+                        size = features[feature].squeeze().shape[0]
                         shape = (int(size**.5), int(size**.5))
                         print(shape)
-                        disp = model.features[mode][feature].reshape(shape)
+                        disp = features[feature].reshape(shape)
                     else:
-                        disp = model.features[mode][feature].squeeze()
+                        disp = features[feature].squeeze()
                     fig_agg.append(update_image(window[feature], disp, feature))
             prev_fig_agg = fig_agg
             
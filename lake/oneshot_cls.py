@@ -4,7 +4,6 @@ import os
 import json
 import argparse
 import logging
-import glob
 from tqdm import tqdm
 
 import numpy as np
@@ -28,12 +27,24 @@ LOG_EVERY = 20
 LOG_EVERY_EVAL = 1
 VAL_EVERY = 20
 VALIDATE = True
-SAVE_EVERY = 1
 MAX_VAL_STEPS = 100
 MAX_PRETRAIN_STEPS = -1
 VAL_SPLIT = 0.175
 SAVE_RUN_MODEL = False
 LOAD_LTM_ONLY = False
+NUM_WORKERS = 4
+
+# Features plotted in the completion summary, as (name, mode key, feature key)
+SUMMARY_SPEC = [
+  ('study_inputs', 'study', 'inputs'),
+  ('study_stm_pr', 'study', 'stm_pr'),
+  ('study_stm_ca3', 'study', 'stm_ca3'),
+
+  ('recall_inputs', 'recall', 'inputs'),
+  ('recall_stm_pr', 'recall', 'stm_pr'),
+  ('recall_stm_ca3', 'recall', 'stm_ca3'),
+  ('recall_stm_recon', 'recall', 'stm_recon')
+]
 
 def main():
   parser = argparse.ArgumentParser(description='Complementary Learning System: One-shot Learning Experiments')
@@ -56,6 +67,12 @@ def main():
 
   device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
+  # Page-locked batches can be copied to the GPU asynchronously (non_blocking=True)
+  pin_memory = device.type == 'cuda'
+
+  # Completion summaries are slow to render, so only draw one every `summary_every` episodes
+  summary_every = config.get('summary_every', 1000)
+
 
   dataset_name = config.get('dataset')
 
@@ -101,17 +118,8 @@ def main():
           print(f"Failed to remove file with path {path} due to exception {e}")
 
     elif train_from == 'latest':
-      model_path = os.path.join(previous_run_path, 'pretrained_model_*')
-      # Find the latest file in the directory
-      latest = max(glob.glob(model_path), key=os.path.getctime)
-
-      # Find the epoch that was stopped on
-      i = len(latest) - 4  # (from before the .pt)
-      latest_epoch = 0
-      while latest[i] != '_':
-        latest_epoch *= 10
-        latest_epoch += int(latest[i])
-        i -= 1
+      # Find the latest checkpoint in the directory, and the epoch that was stopped on
+      latest, latest_epoch = utils.latest_checkpoint(previous_run_path)
 
       if latest_epoch < config['pretrain_epochs']:
         start_epoch = latest_epoch + 1
@@ -143,8 +151,12 @@ def main():
 
     train_set, val_set = torch.utils.data.random_split(dataset, [train_size, val_size])
 
-    train_loader = torch.utils.data.DataLoader(train_set, batch_size=config['pretrain_batch_size'], shuffle=True)
-    val_loader = torch.utils.data.DataLoader(val_set, batch_size=config['pretrain_batch_size'], shuffle=True)
+    train_loader = torch.utils.data.DataLoader(train_set, batch_size=config['pretrain_batch_size'], shuffle=True,
+                                               num_workers=NUM_WORKERS, pin_memory=pin_memory)
+    val_loader = torch.utils.data.DataLoader(val_set, batch_size=config['pretrain_batch_size'], shuffle=True,
+                                             num_workers=NUM_WORKERS, pin_memory=pin_memory)
+
+    ltm_supervised = model.is_ltm_supervised()
 
     # Pre-train the model
     for epoch in range(start_epoch, config['pretrain_epochs'] + 1):
@@ -155,8 +167,8 @@ def main():
           print("Pretrain steps, {}, has exceeded max of {}.".format(batch_idx, MAX_PRETRAIN_STEPS))
           break
 
-        data, target = data.to(device), target.to(device)
-        losses, _ = model(data, labels=target if model.is_ltm_supervised() else None, mode='pretrain')
+        data, target = data.to(device, non_blocking=True), target.to(device, non_blocking=True)
+        losses, _ = model(data, labels=target if ltm_supervised else None, mode='pretrain')
         pretrain_loss = losses['ltm']['memory']['loss'].item()
 
         if batch_idx % LOG_EVERY == 0:
@@ -175,9 +187,9 @@ def main():
                 print("\tval batch steps, {}, has exceeded max of {}.".format(batch_idx_val, MAX_VAL_STEPS))
                 break
 
-              val_data, val_target = val_data.to(device), val_target.to(device)
+              val_data, val_target = val_data.to(device, non_blocking=True), val_target.to(device, non_blocking=True)
 
-              val_losses, _ = model(val_data, labels=val_target if model.is_ltm_supervised() else None, mode='validate')
+              val_losses, _ = model(val_data, labels=val_target if ltm_supervised else None, mode='validate')
               val_pretrain_loss = val_losses['ltm']['memory']['loss'].item()
 
               if batch_idx_val % LOG_EVERY == 0:
@@ -185,10 +197,9 @@ def main():
                   epoch, batch_idx_val, len(val_loader),
                   100. * batch_idx_val / len(val_loader), val_pretrain_loss))
 
-      if epoch % SAVE_EVERY == 0:
-        pretrained_model_path = os.path.join(summary_dir, 'pretrained_model_' + str(epoch) + '.pt')
-        print('Saving model to:', pretrained_model_path)
-        torch.save(model.state_dict(), pretrained_model_path)
+      if utils.should_checkpoint(epoch, config):
+        pretrained_model_path = utils.save_checkpoint(model, summary_dir, epoch)
+        print('Saved model to:', pretrained_model_path)
 
   # Study and Recall
   # ---------------------------------------------------------------------------
@@ -245,8 +256,11 @@ def main():
     recall_dataset = CifarOneShotDataset('./data', mode='test', transform=recall_tfms, target_transform=None,
                         classes=rand_class, download=False)
 
-  study_loader = torch.utils.data.DataLoader(study_dataset, batch_size=config['study_batch_size'], shuffle=False)
-  recall_loader = torch.utils.data.DataLoader(recall_dataset, batch_size=config['study_batch_size'], shuffle=False)
+  # Loaded in the main process so the seeded NumPy RNG used by the recall transforms stays reproducible
+  study_loader = torch.utils.data.DataLoader(study_dataset, batch_size=config['study_batch_size'], shuffle=False,
+                                             pin_memory=pin_memory)
+  recall_loader = torch.utils.data.DataLoader(recall_dataset, batch_size=config['study_batch_size'], shuffle=False,
+                                              pin_memory=pin_memory)
 
   assert len(study_loader) == len(recall_loader)
 
@@ -255,28 +269,37 @@ def main():
   # Initialise metrics
   oneshot_metrics = OneshotMetrics()
 
-  # Initialise CLS
-  model = CLS(image_shape, config, device=device, writer=writer).to(device)
+  # Reuse the CLS built for pretraining: each episode restores the saved weights
+  # below and `model.reset()` re-initialises the STM, so a second instance is not needed
+
+  # Load the saved model once; it is re-applied at the start of every episode
+  model_tensors = dict(model.named_parameters())
+  model_tensors.update(model.named_buffers())
+
+  pretrained_dict = torch.load(pretrained_model_path, map_location=device)
+  pretrained_dict = {k: v for k, v in pretrained_dict.items() if k in model_tensors}
+
+  if LOAD_LTM_ONLY:
+    pretrained_dict = {k: v for k, v in pretrained_dict.items() if k.startswith('ltm')}
+
+  # Pair each saved tensor with the model tensor it restores, so resets are plain in-place copies
+  pretrained_tensors = [(model_tensors[k], v) for k, v in pretrained_dict.items()]
+
+  utils.maybe_compile(model, config)
 
   for idx, ((study_data, study_target), (recall_data, recall_target)) in oneshot_dataset:
     if LOG_EVERY_EVAL > 0 and idx % LOG_EVERY_EVAL == 0:
       print('Step #{}'.format(idx))
 
-    study_data = study_data.to(device)
-    study_target = torch.from_numpy(np.array(study_target)).to(device)
-    recall_data = recall_data.to(device)
-    recall_target = torch.from_numpy(np.array(recall_target)).to(device)
+    study_data = study_data.to(device, non_blocking=True)
+    study_target = torch.as_tensor(study_target, device=device)
+    recall_data = recall_data.to(device, non_blocking=True)
+    recall_target = torch.as_tensor(recall_target, device=device)
 
     # Reset to saved model
-    model_dict = model.state_dict()
-    pretrained_dict = torch.load(pretrained_model_path)
-    pretrained_dict = {k: v for k, v in pretrained_dict.items() if k in model_dict}
-
-    if LOAD_LTM_ONLY:
-      pretrained_dict = {k: v for k, v in pretrained_dict.items() if k.startswith('ltm')}
-
-    model_dict.update(pretrained_dict)
-    model.load_state_dict(pretrained_dict)
+    with torch.no_grad():
+      for model_tensor, pretrained_tensor in pretrained_tensors:
+        model_tensor.copy_(pretrained_tensor)
 
     model.reset()
 
@@ -297,8 +320,9 @@ def main():
 
     # Recall
     # --------------------------------------------------------------------------
-    with torch.no_grad():
+    with utils.inference_mode():
       model(recall_data, recall_target, mode='recall')
+      features = utils.features_to_host(model.features)
 
       if 'metrics' in config and config['metrics']:
         metrics_config = config['metrics']
@@ -307,10 +331,10 @@ def main():
         assert all(x == metrics_len[0] for x in metrics_len), 'Mismatch in metrics config'
 
         for i in range(metrics_len[0]):
-          primary_feature = utils.find_json_value(metrics_config['primary_feature_names'][i], model.features)
-          primary_label = utils.find_json_value(metrics_config['primary_label_names'][i], model.features)
-          secondary_feature = utils.find_json_value(metrics_config['secondary_feature_names'][i], model.features)
-          secondary_label = utils.find_json_value(metrics_config['secondary_label_names'][i], model.features)
+          primary_feature = utils.find_json_value(metrics_config['primary_feature_names'][i], features)
+          primary_label = utils.find_json_value(metrics_config['primary_label_names'][i], features)
+          secondary_feature = utils.find_json_value(metrics_config['secondary_feature_names'][i], features)
+          secondary_label = utils.find_json_value(metrics_config['secondary_label_names'][i], features)
           comparison_type = metrics_config['comparison_types'][i]
           prefix = metrics_config['prefixes'][i]
 
@@ -320,46 +344,34 @@ def main():
                                   comparison_type=comparison_type)
 
       # PR Accuracy (study first) - this is the version used in the paper
-      if 'stm_pr' in model.features['study']:
+      if 'stm_pr' in features['study']:
         oneshot_metrics.compare(prefix='pr_sf_',
-                                primary_features=model.features['study']['stm_pr'],
-                                primary_labels=model.features['study']['labels'],
-                                secondary_features=model.features['recall']['stm_pr'],
-                                secondary_labels=model.features['recall']['labels'],
+                                primary_features=features['study']['stm_pr'],
+                                primary_labels=features['study']['labels'],
+                                secondary_features=features['recall']['stm_pr'],
+                                secondary_labels=features['recall']['labels'],
                                 comparison_type='match_mse')
 
       oneshot_metrics.report()
 
-      summary_names = [
-        'study_inputs',
-        'study_stm_pr',
-        'study_stm_ca3',
-
-        'recall_inputs',
-        'recall_stm_pr',
-        'recall_stm_ca3',
-        'recall_stm_recon'
-      ]
-
-      summary_images = []
-      for name in summary_names:
-        mode_key, feature_key = name.split('_', 1)
-
-        if not feature_key in model.features[mode_key]:
-          continue
+      if idx % summary_every == 0:
+        summary_images = []
+        for name, mode_key, feature_key in SUMMARY_SPEC:
+          if not feature_key in features[mode_key]:
+            continue
 
-        summary_features = model.features[mode_key][feature_key]
+          summary_features = features[mode_key][feature_key]
 
-        if len(summary_features.shape) > 2:
-          summary_features = summary_features.permute(0, 2, 3, 1)
+          if len(summary_features.shape) > 2:
+            summary_features = summary_features.permute(0, 2, 3, 1)
 
-        summary_shape, _ = utils.square_image_shape_from_1d(np.prod(summary_features.data.shape[1:]))
-        summary_shape[0] = summary_features.data.shape[0]
+          summary_shape, _ = utils.square_image_shape_from_1d(np.prod(summary_features.data.shape[1:]))
+          summary_shape[0] = summary_features.data.shape[0]
 
-        summary_image = (name, summary_features, summary_shape)
-        summary_images.append(summary_image)
+          summary_image = (name, summary_features, summary_shape)
+          summary_images.append(summary_image)
 
-      utils.add_completion_summary(summary_images, summary_dir, idx, save_figs=True)
+        utils.add_completion_summary(summary_images, summary_dir, idx, save_figs=True)
 
     # Optional: Save the model checkpoint for this run
     if SAVE_RUN_MODEL:
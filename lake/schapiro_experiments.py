@@ -1,25 +1,23 @@
-import os
 import csv
 import json
 import argparse
 import logging
 import utils
 import datetime
-import glob
 
 import torch
 import torch.nn
+import torch.nn.functional as F
 from torchvision import transforms
 from torch.utils.tensorboard import SummaryWriter
 
 import numpy as np
-from scipy import stats
 
 from cls_module.cls import CLS
 
 from datasets.sequence_generator import SequenceGenerator, SequenceGeneratorGraph, SequenceGeneratorTriads
 from datasets.omniglot_one_shot_dataset import OmniglotTransformation
-from datasets.omniglot_per_alphabet_dataset import OmniglotAlphabet
+from datasets.omniglot_per_alphabet_dataset import OmniglotAlphabet, OmniglotAlphabetBank, bank_alphabet
 from embeddings import Correlations, Overlap
 from Visualisations import HeatmapPlotter, BarPlotter
 from Visualisations import FrequencyPlotter
@@ -28,7 +26,6 @@ from oneshot_metrics import OneshotMetrics
 LOG_EVERY = 20
 LOG_EVERY_EVAL = 1
 VAL_EVERY = 2
-SAVE_EVERY = 1
 MAX_VAL_STEPS = 100
 MAX_PRETRAIN_STEPS = -1
 VAL_SPLIT = 0.175
@@ -38,6 +35,8 @@ def main():
     parser.add_argument('-c', '--config', nargs="?", type=str, help='Configuration file for experiments.')
     parser.add_argument('-l', '--logging', nargs="?", type=str, default='warning',
                         help='Logging level.')
+    parser.add_argument('--csv', action='store_true',
+                        help='Also write the per-seed predictions and pair inputs as CSV files.')
     args = parser.parse_args()
 
     logging_level = getattr(logging, args.logging.upper(), None)
@@ -80,20 +79,48 @@ def main():
 
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
+    pin_memory = device.type == 'cuda'
+
+    # Input shapes are fixed, so let cuDNN pick the fastest algorithms
+    torch.backends.cudnn.benchmark = device.type == 'cuda'
+
+    memory_format = torch.channels_last if config.get('channels_last', False) else torch.contiguous_format
+
+    mixed_precision = config.get('mixed_precision', False)
+
+    summary_every = config.get('summary_every', 1000)
+
     image_tfms = transforms.Compose([
         transforms.ToTensor(),
         OmniglotTransformation(resize_factor=config['image_resize_factor'])])
 
     alphabet_name = config.get('alphabet')
     pretrained_model_path = config.get('pretrained_model_path', None)
-    pearson_r_test = torch.zeros((1, 2))
-    if experiment == 'community_structure':
-        pearson_r_test = torch.zeros((1, 4))
-    pearson_r_test = {k: pearson_r_test for k in components}
     characters = config.get('characters')
-    pearson_r_tensor = torch.zeros((characters, characters))
-    pearson_r_tensor = pearson_r_tensor[None, :, :]
-    pearson_r_tensor = {k: pearson_r_tensor for k in components}
+    # Pearson matrices and test-pattern means of every recall, alternating between early and late responses
+    pearson_r_tensor = {k: [] for k in components}
+    pearson_r_test = {k: [] for k in components}
+
+    # Shared by every seed that pretrains
+    if not pretrained_model_path:
+        dataset = OmniglotAlphabet('./data', alphabet_name, False, own_alphabet=config['own_alphabet'],
+                                   download=True,
+                                   transform=image_tfms,
+                                   target_transform=None)
+        dataset = bank_alphabet(dataset, cache_key=config['image_resize_factor'])
+
+        val_size = round(VAL_SPLIT * len(dataset))
+        train_size = len(dataset) - val_size
+
+        # Split with seed_ltm, leaving the global RNG untouched
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(seed_ltm)
+            train_set, val_set = torch.utils.data.random_split(dataset, [train_size, val_size])
+
+        train_loader = torch.utils.data.DataLoader(train_set, batch_size=config['pretrain_batch_size'], shuffle=True,
+                                                   pin_memory=pin_memory)
+        val_loader = torch.utils.data.DataLoader(val_set, batch_size=config['pretrain_batch_size'], shuffle=True,
+                                                 pin_memory=pin_memory)
 
     for _ in range(seeds):
         seed = np.random.randint(1, 10000)
@@ -106,14 +133,12 @@ def main():
         if pretrained_model_path:
             # summary_dir = pretrained_model_path
              #writer = SummaryWriter(log_dir=summary_dir)
-            model = CLS(config['image_shape'], config, device=device, writer=writer, output_shape=config['pairs_shape']).to(device)
-
-            model_path = os.path.join(pretrained_model_path, 'pretrained_model_*')
-            print(model_path)
-            # Find the latest file in the directory
-            latest = max(glob.glob(model_path), key=os.path.getctime)
+            model = CLS(config['image_shape'], config, device=device, writer=writer, output_shape=config['pairs_shape'])
+            model = model.to(device, memory_format=memory_format)
+            utils.maybe_compile(model, config)
 
-            trained_model_path = latest
+            trained_model_path, _ = utils.latest_checkpoint(pretrained_model_path)
+            print(trained_model_path)
 
             # Load only the LTM part
             pretrained_dict = torch.load(trained_model_path)
@@ -123,20 +148,11 @@ def main():
         else:
             start_epoch = 1
             utils.set_seed(seed_ltm)
-            model = CLS(config['image_shape'], config, device=device, writer=writer, output_shape=config['pairs_shape']).to(device)
-
-            dataset = OmniglotAlphabet('./data', alphabet_name, False, own_alphabet=config['own_alphabet'],
-                                       download=True,
-                                       transform=image_tfms,
-                                       target_transform=None)
-
-            val_size = round(VAL_SPLIT * len(dataset))
-            train_size = len(dataset) - val_size
+            model = CLS(config['image_shape'], config, device=device, writer=writer, output_shape=config['pairs_shape'])
+            model = model.to(device, memory_format=memory_format)
+            utils.maybe_compile(model, config)
 
-            train_set, val_set = torch.utils.data.random_split(dataset, [train_size, val_size])
-
-            train_loader = torch.utils.data.DataLoader(train_set, batch_size=config['pretrain_batch_size'], shuffle=True)
-            val_loader = torch.utils.data.DataLoader(val_set, batch_size=config['pretrain_batch_size'], shuffle=True)
+            ltm_supervised = model.is_ltm_supervised()
 
             # Pre-train the model
             for epoch in range(start_epoch, config['pretrain_epochs'] + 1):
@@ -145,13 +161,12 @@ def main():
                         print("Pretrain steps, {}, has exceeded max of {}.".format(batch_idx, MAX_PRETRAIN_STEPS))
                         break
 
-                    data = data.to(device)
-                    target = target.to(device)
-
-                    losses, _ = model(data, labels=target if model.is_ltm_supervised() else None, mode='pretrain')
-                    pretrain_loss = losses['ltm']['memory']['loss'].item()
+                    data = data.to(device, non_blocking=True, memory_format=memory_format)
+                    target = target.to(device, non_blocking=True)
 
+                    losses, _ = model(data, labels=target if ltm_supervised else None, mode='pretrain')
                     if batch_idx % LOG_EVERY == 0:
+                        pretrain_loss = losses['ltm']['memory']['loss'].item()
                         print('Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}'.format(
                             epoch, batch_idx, len(train_loader),
                             100. * batch_idx / len(train_loader), pretrain_loss))
@@ -159,7 +174,7 @@ def main():
                 if (epoch + 1) % VAL_EVERY == 0:
                     logging.info("\t--- Start validation")
 
-                    with torch.no_grad():
+                    with utils.inference_mode(), utils.autocast(device, mixed_precision):
                         for batch_idx_val, (val_data, val_target) in enumerate(val_loader):
 
                             if batch_idx_val >= MAX_VAL_STEPS:
@@ -168,22 +183,21 @@ def main():
                                 break
 
 
-                            val_data = val_data.to(device)
-                            val_target = val_target.to(device)
+                            val_data = val_data.to(device, non_blocking=True, memory_format=memory_format)
+                            val_target = val_target.to(device, non_blocking=True)
 
-                            val_losses, _ = model(val_data, labels=val_target if model.is_ltm_supervised() else None,
+                            val_losses, _ = model(val_data, labels=val_target if ltm_supervised else None,
                                                   mode='validate_ltm')
-                            val_pretrain_loss = val_losses['ltm']['memory']['loss'].item()
 
                             if batch_idx_val % LOG_EVERY == 0:
+                                val_pretrain_loss = val_losses['ltm']['memory']['loss'].item()
                                 print('\tValidation for Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}'.format(
                                     epoch, batch_idx_val, len(val_loader),
                                     100. * batch_idx_val / len(val_loader), val_pretrain_loss))
 
-                if epoch % SAVE_EVERY == 0:
-                    trained_model_path = os.path.join(summary_dir, 'pretrained_model_' + str(epoch) + '.pt')
-                    print('Saving model to:', trained_model_path)
-                    torch.save(model.state_dict(), trained_model_path)
+                if utils.should_checkpoint(epoch, config):
+                    trained_model_path = utils.save_checkpoint(model, summary_dir, epoch)
+                    print('Saved model to:', trained_model_path)
                 pretrained_model_path = summary_dir
 
         # Study and Recall
@@ -233,12 +247,19 @@ def main():
                                            writer_idx=writer_idx_recall, download=True,
                                            transform=image_tfms, target_transform=None)
 
+        alphabet = bank_alphabet(alphabet, cache_key=config['image_resize_factor'])
+        alphabet_validation = bank_alphabet(alphabet_validation, cache_key=config['image_resize_factor'])
+        alphabet_recall = bank_alphabet(alphabet_recall, cache_key=config['image_resize_factor'])
+
         labels_study = sequence_study.core_label_sequence
+        # First occurrence wins, as with list.index
+        label_to_idx = {tuple(label): i for i, label in reversed(list(enumerate(labels_study)))}
 
-        main_pairs, _, main_pairs_paired = format_data(alphabet, labels_study, labels_study, model, device,
+        main_pairs, _, main_pairs_paired = format_data(alphabet, labels_study, label_to_idx, model, device,
                                               config['activation_coefficient'],
-                                              config['overlap_option'])
+                                              config['overlap_option'], memory_format)
         main_pairs_paired_flat = torch.flatten(main_pairs_paired, start_dim=1)
+        main_pairs_paired_unit = F.normalize(main_pairs_paired_flat.to(device), dim=1, eps=1e-6)
 
 
         single_characters = [alphabet_recall[a][0] for a in range(0, characters)]
@@ -255,7 +276,7 @@ def main():
         recall_target = recall_target[0:batch_size]
         recall_target = torch.tensor(recall_target, dtype=torch.long, device=device)
 
-        recall_data = recall_data.to(device)
+        recall_data = recall_data.to(device, memory_format=memory_format)
         recall_target = recall_target.to(device)
 
         _, recall_data = model(recall_data, recall_target, mode='extractor')
@@ -283,29 +304,29 @@ def main():
                     frequency = FrequencyPlotter(main_summary_dir, study_set, str(seed) + '_' + str(idx))
                     frequency.create_bar()
 
-                study_data, study_target, study_paired_data = format_data(alphabet, study_set, labels_study, model, device,
+                study_data, study_target, study_paired_data = format_data(alphabet, study_set, label_to_idx, model, device,
                                                                           config['activation_coefficient'],
-                                                                          config['overlap_option'])
+                                                                          config['overlap_option'], memory_format)
 
                 study_data = study_data.to(device)
                 study_target = study_target.to(device)
                 study_paired_data = study_paired_data.to(device)
 
-                val_data, val_target, val_paired_data = format_data(alphabet_validation, validation_set, labels_study, model, device,
+                val_data, val_target, val_paired_data = format_data(alphabet_validation, validation_set, label_to_idx, model, device,
                                                                           config['activation_coefficient'],
-                                                                          config['overlap_option'])
+                                                                          config['overlap_option'], memory_format)
                 val_data = val_data.to(device)
                 val_target = val_target.to(device)
                 val_paired_data = val_paired_data.to(device)
 
                 # Study
                 # --------------------------------------------------------------------------
-                for step in range(config['late_response_steps']):
-
-                        study_train_losses, _ = model(study_data, study_target, mode='study', ec_inputs=study_data,
-                                                          paired_inputs=study_paired_data)
-                        study_train_loss = study_train_losses['stm']['memory']['loss']
+                def study_step(step):
+                    study_train_losses, _ = model(study_data, study_target, mode='study', ec_inputs=study_data,
+                                                      paired_inputs=study_paired_data)
+                    study_train_loss = study_train_losses['stm']['memory']['loss']
 
+                    if LOG_EVERY_EVAL > 0 and step % LOG_EVERY_EVAL == 0:
                         if config.get('stm').get('hebbian_perforant'):
                             print('Losses batch {}, ite {}: \t EC_CA3:{:.6f}\
                              \t ca3_ca1: {:.6f}'.format(idx, step, study_train_loss['ec_ca3'].item(),
@@ -317,91 +338,97 @@ def main():
                                                                            study_train_loss['pr_mismatch'].item(),
                                                                            study_train_loss['ca3_ca1'].item()))
 
-                        validation_losses, _ = model(val_data, val_target, mode='validate', ec_inputs=val_data,
-                                                     paired_inputs=val_paired_data)
-
-                        if step == (config['early_response_step']-1) or step == (config['late_response_steps']-1):
-                            with torch.no_grad():
-                                recall_data = recall_data.to(device)
-                                recall_target = recall_target.to(device)
-                                recall_paired_data = recall_paired_data.to(device)
-
-                                _, recall_outputs = model(recall_data, recall_target, mode='recall', ec_inputs=recall_data,
-                                                          paired_inputs=recall_paired_data)
-
-                                # Perform another iteration using recalled outputs
-                                if config.get('recurrence_steps', 0) > 0:
-                                  for rstep in range(config['recurrence_steps']):
-                                    bigloop_ec_inputs = recall_outputs["stm"]["memory"]['ca1']['decoding']
-                                    bigloop_paired_inputs = recall_outputs["stm"]["memory"]['decoding']
-                                    _, recall_outputs = model(bigloop_ec_inputs, recall_target, mode='recall', ec_inputs=bigloop_ec_inputs,
-                                                              paired_inputs=bigloop_paired_inputs)
-
-                                cos = torch.nn.CosineSimilarity(dim=0, eps=1e-6)
-                                for component in components:
-                                    if component == 'dg':
-                                        recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component],
-                                                                        start_dim=1)
-                                    if component == 'pr':
-                                        recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component]['pr_out'],
-                                                                            start_dim=1)
-                                    if component == 'ec_ca3':
-                                        recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component]['ca3_cue'],
-                                                start_dim=1)
-                                    if component == 'ca3':
-                                        recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component],
-                                                                        start_dim=1)
-                                    if component == 'ca3_ca1':
-                                        recall_outputs_flat = torch.flatten(
-                                            recall_outputs["stm"]["memory"][component]['decoding'],
-                                            start_dim=1)
-                                    if component == 'ca1_enc':
-                                        recall_outputs_flat = torch.flatten(
-                                          recall_outputs["stm"]["memory"]['ca1']['encoding'],
-                                          start_dim=1)
-                                    if component == 'ca1_dec':
-                                        recall_outputs_flat = torch.flatten(
-                                            recall_outputs["stm"]["memory"]['ca1']['decoding'],
-                                            start_dim=1)
-                                        if experiment == "associative_inference" and step == (config['late_response_steps']-1):
-                                            correlator.transitivity(recall_outputs_flat[0:characters], recall_data[0:characters])
-                                    if component == 'recon_pair':
-                                        recall_outputs_flat = torch.flatten(
-                                            recall_outputs["stm"]["memory"]['decoding'],
-                                            start_dim=1)
-                                        similarity = [[cos(a, b) for b in main_pairs_paired_flat.cpu()] for a in recall_outputs_flat.cpu()]
-                                        similarity_idx = [t.index(max(t)) for t in similarity]
-                                        predictions.extend([[labels_study[a] for a in similarity_idx]])
-
-                                    recall_outputs_flat = recall_outputs_flat[0:characters].cpu()
-                                    pearson_r = [[stats.pearsonr(a, b)[0] for a in recall_outputs_flat] for b in
-                                                 recall_outputs_flat]
-                                    pearson_r = torch.tensor(pearson_r, dtype=torch.float32)
-                                    pearson_r_tensor[component] = torch.cat((pearson_r_tensor[component], pearson_r[None, :, :]), 0)
-
-                                    if experiment == 'pairs_structure':
-                                        pearson_all_pattern = sum([pearson_r[i, j] for (i, j) in sequence_study.test_sequence])/len(sequence_study.test_sequence)
-                                        pearson_core_pattern = sum([pearson_r[i, j] for (i, j) in sequence_study.core_sequence]) / len(sequence_study.core_sequence)
-                                        tmp_pearson_test = torch.tensor([[pearson_core_pattern, pearson_all_pattern]])
-                                    if experiment == 'associative_inference':
-                                        pearson_transitive_pattern = sum([pearson_r[i, j] for (i, j) in sequence_study.test_sequence]) / len(sequence_study.test_sequence)
-                                        pearson_direct_pattern = sum([pearson_r[i, j] for (i, j) in sequence_study.core_sequence]) / len(sequence_study.core_sequence)
-                                        pearson_base_pattern = sum([pearson_r[i, j] for (i, j) in sequence_study.base_sequence]) / len(sequence_study.base_sequence)
-                                        tmp_pearson_test = torch.tensor([[pearson_transitive_pattern - pearson_base_pattern, pearson_direct_pattern-pearson_base_pattern]])
-                                    if experiment == 'community_structure':
-                                        pearson_within_internal = sum([pearson_r[i, j] for (i, j) in sequence_study.graph_sequences[0]]) / len(sequence_study.graph_sequences[0])
-                                        pearson_within_boundary = sum([pearson_r[i, j] for (i, j) in sequence_study.graph_sequences[1]]) / len(sequence_study.graph_sequences[1])
-                                        pearson_across_boundary = sum([pearson_r[i, j] for (i, j) in sequence_study.graph_sequences[2]]) / len(sequence_study.graph_sequences[2])
-                                        pearson_across_other = sum([pearson_r[i, j] for (i, j) in sequence_study.graph_sequences[3]]) / len(sequence_study.graph_sequences[3])
-                                        tmp_pearson_test = torch.tensor([[pearson_within_internal, pearson_within_boundary, pearson_across_boundary, pearson_across_other]])
-
-                                    pearson_r_test[component] = torch.cat((pearson_r_test[component], tmp_pearson_test), 0)
+                    validation_losses, _ = model(val_data, val_target, mode='validate', ec_inputs=val_data,
+                                                 paired_inputs=val_paired_data)
+
+                def recall_eval(step):
+                    with torch.no_grad(), utils.autocast(device, mixed_precision):
+                        _, recall_outputs = model(recall_data, recall_target, mode='recall', ec_inputs=recall_data,
+                                                  paired_inputs=recall_paired_data)
+
+                        # Perform another iteration using recalled outputs
+                        if config.get('recurrence_steps', 0) > 0:
+                          for rstep in range(config['recurrence_steps']):
+                            bigloop_ec_inputs = recall_outputs["stm"]["memory"]['ca1']['decoding']
+                            bigloop_paired_inputs = recall_outputs["stm"]["memory"]['decoding']
+                            _, recall_outputs = model(bigloop_ec_inputs, recall_target, mode='recall', ec_inputs=bigloop_ec_inputs,
+                                                      paired_inputs=bigloop_paired_inputs)
+
+                        for component in components:
+                            if component == 'dg':
+                                recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component],
+                                                                start_dim=1)
+                            if component == 'pr':
+                                recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component]['pr_out'],
+                                                                    start_dim=1)
+                            if component == 'ec_ca3':
+                                recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component]['ca3_cue'],
+                                        start_dim=1)
+                            if component == 'ca3':
+                                recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component],
+                                                                start_dim=1)
+                            if component == 'ca3_ca1':
+                                recall_outputs_flat = torch.flatten(
+                                    recall_outputs["stm"]["memory"][component]['decoding'],
+                                    start_dim=1)
+                            if component == 'ca1_enc':
+                                recall_outputs_flat = torch.flatten(
+                                  recall_outputs["stm"]["memory"]['ca1']['encoding'],
+                                  start_dim=1)
+                            if component == 'ca1_dec':
+                                recall_outputs_flat = torch.flatten(
+                                    recall_outputs["stm"]["memory"]['ca1']['decoding'],
+                                    start_dim=1)
+                                if experiment == "associative_inference" and step == (config['late_response_steps']-1):
+                                    correlator.transitivity(recall_outputs_flat[0:characters], recall_data[0:characters])
+                            if component == 'recon_pair':
+                                recall_outputs_flat = torch.flatten(
+                                    recall_outputs["stm"]["memory"]['decoding'],
+                                    start_dim=1)
+                                # Cosine similarity to every main pair
+                                recall_outputs_unit = F.normalize(recall_outputs_flat.to(device), dim=1, eps=1e-6)
+                                similarity = recall_outputs_unit @ main_pairs_paired_unit.T
+                                similarity_idx = similarity.argmax(dim=1).tolist()
+                                predictions.extend([[labels_study[a] for a in similarity_idx]])
+
+                            recall_outputs_flat = recall_outputs_flat[0:characters]
+                            pearson_r = utils.pearson_correlation_matrix(recall_outputs_flat, recall_outputs_flat).cpu()
+                            pearson_r_tensor[component].append(pearson_r)
+
+                            if experiment == 'pairs_structure':
+                                pearson_all_pattern = pearson_r[sequence_study.test_idx].mean()
+                                pearson_core_pattern = pearson_r[sequence_study.core_idx].mean()
+                                tmp_pearson_test = torch.stack([pearson_core_pattern, pearson_all_pattern])[None, :]
+                            if experiment == 'associative_inference':
+                                pearson_transitive_pattern = pearson_r[sequence_study.test_idx].mean()
+                                pearson_direct_pattern = pearson_r[sequence_study.core_idx].mean()
+                                pearson_base_pattern = pearson_r[sequence_study.base_idx].mean()
+                                tmp_pearson_test = torch.stack([pearson_transitive_pattern - pearson_base_pattern, pearson_direct_pattern-pearson_base_pattern])[None, :]
+                            if experiment == 'community_structure':
+                                tmp_pearson_test = torch.stack([pearson_r[idx_pairs].mean() for idx_pairs in sequence_study.graph_idx])[None, :]
+
+                            pearson_r_test[component].append(tmp_pearson_test)
+
+                recall_data = recall_data.to(device)
+                recall_target = recall_target.to(device)
+                recall_paired_data = recall_paired_data.to(device)
+
+                # Train up to, then recall after, the early and the late response steps
+                recall_steps = sorted({s for s in (config['early_response_step'] - 1, config['late_response_steps'] - 1)
+                                       if 0 <= s < config['late_response_steps']})
+                next_step = 0
+                for recall_step in recall_steps:
+                    for step in range(next_step, recall_step + 1):
+                        study_step(step)
+                    recall_eval(recall_step)
+                    next_step = recall_step + 1
 
                 pairs_inputs.extend([[(int(a[0]), int(a[1])) for a in study_set]])
 
 
                 # --------------------------------------------------------------------------
                 with torch.no_grad():
+                    features = utils.features_to_host(model.features)
 
                     if 'metrics' in config and config['metrics']:
                         metrics_config = config['metrics']
@@ -410,11 +437,11 @@ def main():
                         assert all(x == metrics_len[0] for x in metrics_len), 'Mismatch in metrics config'
 
                         for i in range(metrics_len[0]):
-                            primary_feature = utils.find_json_value(metrics_config['primary_feature_names'][i], model.features)
-                            primary_label = utils.find_json_value(metrics_config['primary_label_names'][i], model.features)
+                            primary_feature = utils.find_json_value(metrics_config['primary_feature_names'][i], features)
+                            primary_label = utils.find_json_value(metrics_config['primary_label_names'][i], features)
                             secondary_feature = utils.find_json_value(metrics_config['secondary_feature_names'][i],
-                                                                          model.features)
-                            secondary_label = utils.find_json_value(metrics_config['secondary_label_names'][i], model.features)
+                                                                          features)
+                            secondary_label = utils.find_json_value(metrics_config['secondary_label_names'][i], features)
                             comparison_type = metrics_config['comparison_types'][i]
                             prefix = metrics_config['prefixes'][i]
 
@@ -429,95 +456,102 @@ def main():
                             stm_feature = 'stm_pr'
 
                         oneshot_metrics.compare(prefix='pr_rf_',
-                                                 primary_features=model.features['recall'][stm_feature],
-                                                 primary_labels=model.features['recall']['labels'],
-                                                 secondary_features=model.features['study'][stm_feature],
-                                                 secondary_labels=model.features['study']['labels'],
+                                                 primary_features=features['recall'][stm_feature],
+                                                 primary_labels=features['recall']['labels'],
+                                                 secondary_features=features['study'][stm_feature],
+                                                 secondary_labels=features['study']['labels'],
                                                  comparison_type='match_mse')
 
                         oneshot_metrics.report()
 
-                        summary_names = [
-                            'study_paired_inputs',
-                            'study_' + stm_feature,
-                            'study_stm_ca3',
+                        if idx % summary_every == 0:
+                            summary_names = [
+                                'study_paired_inputs',
+                                'study_' + stm_feature,
+                                'study_stm_ca3',
 
-                            'recall_paired_inputs',
-                            'recall_' + stm_feature,
-                            'recall_stm_ca3',
-                            'recall_stm_recon'
-                        ]
+                                'recall_paired_inputs',
+                                'recall_' + stm_feature,
+                                'recall_stm_ca3',
+                                'recall_stm_recon'
+                            ]
 
-                        summary_images = []
-                        for name in summary_names:
-                            mode_key, feature_key = name.split('_', 1)
+                            summary_images = []
+                            for name in summary_names:
+                                mode_key, feature_key = name.split('_', 1)
 
-                            summary_features = model.features[mode_key][feature_key]
-                            if len(summary_features.shape) > 2:
-                                summary_features = summary_features.permute(0, 2, 3, 1)
+                                summary_features = features[mode_key][feature_key]
+                                if len(summary_features.shape) > 2:
+                                    summary_features = summary_features.permute(0, 2, 3, 1)
 
-                            summary_shape, _ = utils.square_image_shape_from_1d(np.prod(summary_features.data.shape[1:]))
-                            summary_shape[0] = summary_features.data.shape[0]
+                                summary_shape, _ = utils.square_image_shape_from_1d(np.prod(summary_features.data.shape[1:]))
+                                summary_shape[0] = summary_features.data.shape[0]
 
-                            summary_image = (name, summary_features, summary_shape)
-                            summary_images.append(summary_image)
+                                summary_image = (name, summary_features, summary_shape)
+                                summary_images.append(summary_image)
 
-                        utils.add_completion_summary(summary_images, summary_dir, str(idx) + '_' + str(stm_epoch) + '_'
-                                                     + str(seed), save_figs=True)
+                            utils.add_completion_summary(summary_images, summary_dir, str(idx) + '_' + str(stm_epoch) + '_'
+                                                         + str(seed), save_figs=True)
 
         # Save results
         predictions_early = predictions[0:predictions.__len__():2]
         predictions_late = predictions[1:predictions.__len__():2]
 
-        with open(main_summary_dir + '/predictions_early_' + str(seed) + '.csv', 'w', encoding='UTF8') as f:
-            writer_file = csv.writer(f)
-            writer_file.writerows(predictions_early)
+        np.savez_compressed(main_summary_dir + '/results_' + str(seed) + '.npz',
+                            predictions_early=utils.concat_pairs(predictions_early),
+                            predictions_late=utils.concat_pairs(predictions_late),
+                            pair_inputs=utils.concat_pairs(pairs_inputs))
 
-        with open(main_summary_dir + '/predictions_late_' + '_' + str(seed)+'.csv', 'w', encoding='UTF8') as f:
-            writer_file = csv.writer(f)
-            writer_file.writerows(predictions_late)
+        if args.csv:
+            with open(main_summary_dir + '/predictions_early_' + str(seed) + '.csv', 'w', encoding='UTF8') as f:
+                writer_file = csv.writer(f)
+                writer_file.writerows(predictions_early)
 
-        with open(main_summary_dir + '/pair_inputs_'+ str(seed) + '.csv', 'w', encoding='UTF8') as f:
-            writer_file = csv.writer(f)
-            writer_file.writerows(pairs_inputs)
+            with open(main_summary_dir + '/predictions_late_' + '_' + str(seed)+'.csv', 'w', encoding='UTF8') as f:
+                writer_file = csv.writer(f)
+                writer_file.writerows(predictions_late)
+
+            with open(main_summary_dir + '/pair_inputs_'+ str(seed) + '.csv', 'w', encoding='UTF8') as f:
+                writer_file = csv.writer(f)
+                writer_file.writerows(pairs_inputs)
 
         oneshot_metrics.report_averages()
         writer.flush()
         writer.close()
 
-    pearson_r_early = {a: pearson_r_tensor[a][1:pearson_r_tensor[a].shape[0]:2] for a in pearson_r_tensor}
-    pearson_r_late = {a: pearson_r_tensor[a][2:pearson_r_tensor[a].shape[0] + 1:2] for a in pearson_r_tensor}
+    pearson_r_tensor = {a: torch.stack(pearson_r_tensor[a], 0) for a in pearson_r_tensor}
+    pearson_r_test = {a: torch.cat(pearson_r_test[a], 0) for a in pearson_r_test}
+
+    pearson_r_early = {a: pearson_r_tensor[a][0::2] for a in pearson_r_tensor}
+    pearson_r_late = {a: pearson_r_tensor[a][1::2] for a in pearson_r_tensor}
     pearson_r_early = {a: torch.mean(pearson_r_early[a], 0) for a in pearson_r_early}
     pearson_r_late = {a: torch.mean(pearson_r_late[a], 0) for a in pearson_r_late}
 
-    pearson_r_early_test = {a: pearson_r_test[a][1:pearson_r_test[a].shape[0]:2] for a in pearson_r_test}
-    pearson_r_late_test = {a: pearson_r_test[a][2:pearson_r_test[a].shape[0] + 1:2] for a in
-                                 pearson_r_test}
+    pearson_r_early_test = {a: pearson_r_test[a][0::2] for a in pearson_r_test}
+    pearson_r_late_test = {a: pearson_r_test[a][1::2] for a in pearson_r_test}
+
+    np.savez_compressed(main_summary_dir + '/pearson_results.npz',
+                        **{'pearson_early_' + a: v.numpy() for a, v in pearson_r_early.items()},
+                        **{'pearson_late_' + a: v.numpy() for a, v in pearson_r_late.items()},
+                        **{'pearson_early_test_' + a: v.numpy() for a, v in pearson_r_early_test.items()},
+                        **{'pearson_late_test_' + a: v.numpy() for a, v in pearson_r_late_test.items()})
 
-    # Visualisations
+    # Visualisations (the plotters read the Pearson CSVs, so these are always written)
     for a in pearson_r_early_test.keys():
-        with open(main_summary_dir + '/pearson_early_test_' + a + '.csv',
-                  'w', encoding='UTF8') as f:
-            writer_file = csv.writer(f)
-            writer_file.writerows(np.stack(pearson_r_early_test[a].numpy(), 0))
+        np.savetxt(main_summary_dir + '/pearson_early_test_' + a + '.csv', pearson_r_early_test[a].numpy(),
+                   fmt='%.9g', delimiter=',', encoding='UTF8')
 
     for a in pearson_r_late_test.keys():
-        with open(main_summary_dir + '/pearson_late_test_' + a + '.csv',
-                  'w', encoding='UTF8') as f:
-            writer_file = csv.writer(f)
-            writer_file.writerows(np.stack(pearson_r_late_test[a].numpy(), 0))
+        np.savetxt(main_summary_dir + '/pearson_late_test_' + a + '.csv', pearson_r_late_test[a].numpy(),
+                   fmt='%.9g', delimiter=',', encoding='UTF8')
 
     for a in pearson_r_early.keys():
-        with open(main_summary_dir + '/pearson_early_' + a + '.csv', 'w',
-                  encoding='UTF8') as f:
-            writer_file = csv.writer(f)
-            writer_file.writerows(pearson_r_early[a].numpy())
+        np.savetxt(main_summary_dir + '/pearson_early_' + a + '.csv', pearson_r_early[a].numpy(),
+                   fmt='%.9g', delimiter=',', encoding='UTF8')
 
     for a in pearson_r_late.keys():
-        with open(main_summary_dir + '/pearson_late_' + a + '.csv', 'w',
-                  encoding='UTF8') as f:
-            writer_file = csv.writer(f)
-            writer_file.writerows(pearson_r_late[a].numpy())
+        np.savetxt(main_summary_dir + '/pearson_late_' + a + '.csv', pearson_r_late[a].numpy(),
+                   fmt='%.9g', delimiter=',', encoding='UTF8')
 
     for a in pearson_r_early.keys():
          heatmap_early = HeatmapPlotter(main_summary_dir, a, "pearson_early_" + a)
@@ -528,7 +562,22 @@ def main():
     bars = BarPlotter(main_summary_dir, pearson_r_early.keys())
     bars.create_bar()
 
-def convert_sequence_to_images(alphabet, sequence, main_labels, element='first'):
+def convert_sequence_to_images(alphabet, sequence, label_to_idx, element='first'):
+    if isinstance(alphabet, OmniglotAlphabetBank):
+        sequence = torch.as_tensor(sequence).long()
+        images_first, labels_first = alphabet[sequence[:, 0]]
+        images_second, labels_second = alphabet[sequence[:, 1]]
+        if element == 'both':
+            pairs_images = torch.cat((images_first, images_second), 3)
+        if element == 'first':
+            pairs_images = images_first
+        if element == 'second':
+            pairs_images = images_second
+        labels = list(zip(labels_first, labels_second))
+        labels = [label_to_idx[value] for value in labels]
+
+        return pairs_images, labels
+
     if element == 'both':
         pairs_images = [torch.cat((alphabet[int(a[0])][0], alphabet[int(a[1])][0]), 2) for a in sequence]
     if element == 'first':
@@ -536,41 +585,39 @@ def convert_sequence_to_images(alphabet, sequence, main_labels, element='first')
     if element == 'second':
         pairs_images = [alphabet[int(a[1])][0] for a in sequence]
     labels = [(alphabet[int(a[0])][1], alphabet[int(a[1])][1]) for a in sequence]
-    labels = [main_labels.index(value) for value in labels]
+    labels = [label_to_idx[value] for value in labels]
 
     pairs_images = torch.stack(pairs_images, 0)
 
     return pairs_images, labels
 
-def format_data(alphabet, data, labels, model,device, coefficient, option):
+def format_data(alphabet, data, label_to_idx, model,device, coefficient, option, memory_format=torch.contiguous_format):
     paired_data, paired_target = convert_sequence_to_images(alphabet=alphabet,
                                                                         sequence=data, element='both',
-                                                                        main_labels=labels)
+                                                                        label_to_idx=label_to_idx)
 
     data_A, target = convert_sequence_to_images(alphabet=alphabet,
                                                             sequence=data,
                                                             element='first',
-                                                            main_labels=labels)
+                                                            label_to_idx=label_to_idx)
     data_B, _ = convert_sequence_to_images(alphabet=alphabet,
                                                  sequence=data,
                                                  element='second',
-                                                 main_labels=labels)
+                                                 label_to_idx=label_to_idx)
     target = torch.tensor(target, dtype=torch.long, device=device)
 
-    data_A = data_A.to(device)
-    data_B = data_B.to(device)
+    data_A = data_A.to(device, memory_format=memory_format)
+    data_B = data_B.to(device, memory_format=memory_format)
 
+    # The halves are extracted separately, as the LTM batch norm always normalises with the statistics of its batch
     _, data_A = model(data_A, target, mode='extractor')
     _, data_B = model(data_B, target, mode='extractor')
+    data_A = data_A['ltm']['memory']['output'].detach()
+    data_B = data_B['ltm']['memory']['output'].detach()
 
-    data = torch.empty(data_A['ltm']['memory']['output'].size(), dtype=torch.float32)
-
-    for i in range(data_A['ltm']['memory']['output'].size(0)):
-        data_A_i = data_A['ltm']['memory']['output'].detach()[i]
-        data_B_i = data_B['ltm']['memory']['output'].detach()[i]
-        embedder = Overlap(coefficient, option)
-        data_i = embedder.join(data_A_i, data_B_i)
-        data[i] = data_i
+    # Overlap joins elementwise, so the whole batch can be joined at once
+    embedder = Overlap(coefficient, option)
+    data = embedder.join(data_A, data_B).to('cpu', torch.float32)
 
     return data, target, paired_data
 
@@ -1,4 +1,3 @@
-import os
 import csv
 import json
 import argparse
@@ -6,15 +5,14 @@ import logging
 import utils
 import torch
 import torch.nn
+import torch.nn.functional as F
 import numpy as np
 import datetime
-import glob
-from scipy import stats
 from torch.utils.tensorboard import SummaryWriter
 from cls_module.cls import CLS
 from datasets.sequence_generator import SequenceGenerator, SequenceGeneratorGraph, SequenceGeneratorTriads
 from datasets.omniglot_one_shot_dataset import OmniglotTransformation
-from datasets.omniglot_per_alphabet_dataset import OmniglotAlphabet
+from datasets.omniglot_per_alphabet_dataset import OmniglotAlphabet, OmniglotAlphabetBank, bank_alphabet
 # from Visualisations import HeatmapPlotter
 from torchvision import transforms
 from oneshot_metrics import OneshotMetrics
@@ -22,7 +20,6 @@ from oneshot_metrics import OneshotMetrics
 LOG_EVERY = 20
 LOG_EVERY_EVAL = 1
 VAL_EVERY = 20
-SAVE_EVERY = 1
 MAX_VAL_STEPS = 100
 MAX_PRETRAIN_STEPS = -1
 VAL_SPLIT = 0.175
@@ -33,6 +30,8 @@ def main():
                         help='Configuration file for experiments.')
     parser.add_argument('-l', '--logging', nargs="?", type=str, default='warning',
                         help='Logging level.')
+    parser.add_argument('--csv', action='store_true',
+                        help='Also write the per-epoch predictions, pair inputs and Pearson matrices as CSV files.')
 
     args = parser.parse_args()
 
@@ -63,6 +62,16 @@ def main():
 
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
+    pin_memory = device.type == 'cuda'
+
+    torch.backends.cudnn.benchmark = device.type == 'cuda'
+
+    memory_format = torch.channels_last if config.get('channels_last', False) else torch.contiguous_format
+
+    mixed_precision = config.get('mixed_precision', False)
+
+    summary_every = config.get('summary_every', 1000)
+
     image_tfms = transforms.Compose([
         transforms.ToTensor(),
         OmniglotTransformation(resize_factor=config['image_resize_factor'])])
@@ -80,6 +89,24 @@ def main():
     pretrained_model_path = config.get('pretrained_model_path', None)
     contiguous_images = config.get('contiguous_images')
 
+    if not pretrained_model_path:
+        dataset = OmniglotAlphabet('./data', alphabet_name, False, writer_idx='any', download=True,
+                                   transform=image_tfms,
+                                   target_transform=None)
+        dataset = bank_alphabet(dataset, cache_key=config['image_resize_factor'])
+
+        val_size = round(VAL_SPLIT * len(dataset))
+        train_size = len(dataset) - val_size
+
+        with torch.random.fork_rng(devices=[]):
+            torch.manual_seed(seed_ltm)
+            train_set, val_set = torch.utils.data.random_split(dataset, [train_size, val_size])
+
+        train_loader = torch.utils.data.DataLoader(train_set, batch_size=config['pretrain_batch_size'], shuffle=True,
+                                                   pin_memory=pin_memory)
+        val_loader = torch.utils.data.DataLoader(val_set, batch_size=config['pretrain_batch_size'], shuffle=True,
+                                                 pin_memory=pin_memory)
+
     for _ in range(seeds):
         seed = np.random.randint(1, 10000)
         utils.set_seed(seed)
@@ -91,32 +118,22 @@ def main():
         if pretrained_model_path:
             # summary_dir = pretrained_model_path
              #writer = SummaryWriter(log_dir=summary_dir)
-            model = CLS(image_shape, config, device=device, writer=writer, output_shape=final_shape).to(device)
-
-            model_path = os.path.join(pretrained_model_path, 'pretrained_model_*')
-            print(model_path)
-            # Find the latest file in the directory
-            latest = max(glob.glob(model_path), key=os.path.getctime)
+            model = CLS(image_shape, config, device=device, writer=writer, output_shape=final_shape)
+            model = model.to(device, memory_format=memory_format)
+            utils.maybe_compile(model, config)
 
-            trained_model_path = latest
+            trained_model_path, _ = utils.latest_checkpoint(pretrained_model_path)
+            print(trained_model_path)
             model.load_state_dict(torch.load(trained_model_path))
 
         else:
             start_epoch = 1
             utils.set_seed(seed_ltm)
-            model = CLS(image_shape, config, device=device, writer=writer, output_shape=final_shape).to(device)
+            model = CLS(image_shape, config, device=device, writer=writer, output_shape=final_shape)
+            model = model.to(device, memory_format=memory_format)
+            utils.maybe_compile(model, config)
 
-            dataset = OmniglotAlphabet('./data', alphabet_name, False, writer_idx='any', download=True,
-                                       transform=image_tfms,
-                                       target_transform=None)
-
-            val_size = round(VAL_SPLIT * len(dataset))
-            train_size = len(dataset) - val_size
-
-            train_set, val_set = torch.utils.data.random_split(dataset, [train_size, val_size])
-
-            train_loader = torch.utils.data.DataLoader(train_set, batch_size=config['pretrain_batch_size'], shuffle=True)
-            val_loader = torch.utils.data.DataLoader(val_set, batch_size=config['pretrain_batch_size'], shuffle=True)
+            ltm_supervised = model.is_ltm_supervised()
 
             # Pre-train the model
             for epoch in range(start_epoch, config['pretrain_epochs'] + 1):
@@ -136,13 +153,12 @@ def main():
                         data = torch.cat((data, data_mirror))
                         target = torch.cat((target, target+len(target)))
 
-                    data = data.to(device)
-                    target = target.to(device)
-
-                    losses, _ = model(data, labels=target if model.is_ltm_supervised() else None, mode='pretrain')
-                    pretrain_loss = losses['ltm']['memory']['loss'].item()
+                    data = data.to(device, non_blocking=True, memory_format=memory_format)
+                    target = target.to(device, non_blocking=True)
 
+                    losses, _ = model(data, labels=target if ltm_supervised else None, mode='pretrain')
                     if batch_idx % LOG_EVERY == 0:
+                        pretrain_loss = losses['ltm']['memory']['loss'].item()
                         print('Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}'.format(
                             epoch, batch_idx, len(train_loader),
                             100. * batch_idx / len(train_loader), pretrain_loss))
@@ -150,7 +166,7 @@ def main():
                     if batch_idx % VAL_EVERY == 0 or batch_idx == len(train_loader) - 1:
                         logging.info("\t--- Start validation")
 
-                        with torch.no_grad():
+                        with utils.inference_mode(), utils.autocast(device, mixed_precision):
                             for batch_idx_val, (val_data, val_target) in enumerate(val_loader):
 
                                 if batch_idx_val >= MAX_VAL_STEPS:
@@ -161,22 +177,21 @@ def main():
                                 if contiguous_images:
                                     val_data = add_empty_character(val_data)
 
-                                val_data = val_data.to(device)
+                                val_data = val_data.to(device, non_blocking=True, memory_format=memory_format)
                                 target = target.to(device)
 
-                                val_losses, _ = model(val_data, labels=val_target if model.is_ltm_supervised() else None,
+                                val_losses, _ = model(val_data, labels=val_target if ltm_supervised else None,
                                                       mode='validate')
-                                val_pretrain_loss = val_losses['ltm']['memory']['loss'].item()
 
                                 if batch_idx_val % LOG_EVERY == 0:
+                                    val_pretrain_loss = val_losses['ltm']['memory']['loss'].item()
                                     print('\tValidation for Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}'.format(
                                         epoch, batch_idx_val, len(val_loader),
                                         100. * batch_idx_val / len(val_loader), val_pretrain_loss))
 
-                if epoch % SAVE_EVERY == 0:
-                    trained_model_path = os.path.join(summary_dir, 'pretrained_model_' + str(epoch) + '.pt')
-                    print('Saving model to:', trained_model_path)
-                    torch.save(model.state_dict(), trained_model_path)
+                if utils.should_checkpoint(epoch, config):
+                    trained_model_path = utils.save_checkpoint(model, summary_dir, epoch)
+                    print('Saved model to:', trained_model_path)
                 pretrained_model_path = summary_dir
 
         # Load the pretrained model
@@ -210,77 +225,81 @@ def main():
             sequence_study = SequenceGeneratorTriads(characters, length, learning_type, batch_size)
             sequence_recall = SequenceGeneratorTriads(characters, length, learning_type, batch_size)
 
-        for stm_epoch in range(config['train_epochs']):
+        # Load images from the selected alphabet from a specific writer or random writers
+        alphabet = OmniglotAlphabet('./data', alphabet_name, True, False, idx_study, download=True,
+                                    transform=image_tfms, target_transform=None)
+        alphabet_blur = OmniglotAlphabet('./data', alphabet_name, True, False, idx_study, download=True,
+                                     transform=image_tfms_blur, target_transform=None)
+        alphabet = bank_alphabet(alphabet, cache_key=config['image_resize_factor'])
+        # The Gaussian blur draws a new sigma on every access, so those images can't be precomputed
+        if not config['activation']:
+            alphabet_blur = bank_alphabet(alphabet_blur, cache_key=config['image_resize_factor'])
+        if experiment == "community_structure":
+            alphabet_blur = alphabet
+        alphabet_recall = OmniglotAlphabet('./data', alphabet_name, True, variation, idx_recall, download=True,
+                                           transform=image_tfms, target_transform=None)
+        alphabet_recall = bank_alphabet(alphabet_recall, cache_key=config['image_resize_factor'])
+
+        labels_study = sequence_study.core_label_sequence
+        label_to_idx = {tuple(label): i for i, label in reversed(list(enumerate(labels_study)))}
+        main_pairs, _ = convert_sequence_to_images(alphabet=alphabet, sequence=labels_study, element='both',
+                                                   label_to_idx=label_to_idx, second_alphabet=alphabet)
+        main_pairs_flat = torch.flatten(main_pairs, start_dim=1)
+        main_pairs_unit = F.normalize(main_pairs_flat.to(device), dim=1, eps=1e-6)
+        single_characters_original = [alphabet_recall[a][0] for a in range(0, characters)]
+        if contiguous_images:
+            single_characters = add_empty_character(single_characters_original)
+            if mirror:
+                single_characters_mirror = add_empty_character(single_characters_original, mirror)
+                single_characters = torch.cat((single_characters, single_characters_mirror), 0)
+                characters = characters*2
+        else:
+            single_characters = single_characters_original
+            single_characters = torch.stack(single_characters)
 
-            sequence_study_tensor = torch.FloatTensor(sequence_study.sequence)
-            sequence_recall_tensor = torch.FloatTensor(sequence_recall.sequence)
-            study_loader = torch.utils.data.DataLoader(sequence_study_tensor, batch_size=batch_size, shuffle=False)
-            recall_loader = torch.utils.data.DataLoader(sequence_recall_tensor, batch_size=batch_size, shuffle=False)
+        sequence_study_tensor = torch.FloatTensor(sequence_study.sequence)
+        sequence_recall_tensor = torch.FloatTensor(sequence_recall.sequence)
+        study_loader = torch.utils.data.DataLoader(sequence_study_tensor, batch_size=batch_size, shuffle=False)
+        recall_loader = torch.utils.data.DataLoader(sequence_recall_tensor, batch_size=batch_size, shuffle=False)
 
-            pair_sequence_dataset = enumerate(zip(study_loader, recall_loader))
+        # Initialise metrics
+        oneshot_metrics = OneshotMetrics()
 
-            # Load images from the selected alphabet from a specific writer or random writers
-            alphabet = OmniglotAlphabet('./data', alphabet_name, True, False, idx_study, download=True,
-                                        transform=image_tfms, target_transform=None)
-            alphabet_blur = OmniglotAlphabet('./data', alphabet_name, True, False, idx_study, download=True,
-                                         transform=image_tfms_blur, target_transform=None)
-            if experiment == "community_structure":
-                alphabet_blur = alphabet
-            alphabet_recall = OmniglotAlphabet('./data', alphabet_name, True, variation, idx_recall, download=True,
-                                               transform=image_tfms, target_transform=None)
-
-            labels_study = sequence_study.core_label_sequence
-            main_pairs, _ = convert_sequence_to_images(alphabet=alphabet, sequence=labels_study, element='both',
-                                                       main_labels=labels_study, second_alphabet=alphabet)
-            main_pairs_flat = torch.flatten(main_pairs, start_dim=1)
-            single_characters_original = [alphabet_recall[a][0] for a in range(0, characters)]
-            if contiguous_images:
-                single_characters = add_empty_character(single_characters_original)
-                if mirror:
-                    single_characters_mirror = add_empty_character(single_characters_original, mirror)
-                    single_characters = torch.cat((single_characters, single_characters_mirror), 0)
-                    characters = characters*2
-            else:
-                single_characters = single_characters_original
-                single_characters = torch.stack(single_characters)
-            # Initialise metrics
-            oneshot_metrics = OneshotMetrics()
+        for stm_epoch in range(config['train_epochs']):
+
+            pair_sequence_dataset = enumerate(zip(study_loader, recall_loader))
 
             predictions = []
             pairs_inputs = []
-            pearson_r_tensor = torch.zeros((characters, characters))
-            pearson_r_tensor = pearson_r_tensor[None, :, :]
-            pearson_r_tensor = {k: pearson_r_tensor for k in components}
+            # Pearson matrices of every recall, alternating between initial and settled responses
+            pearson_r_tensor = {k: [] for k in components}
 
             for idx, (study_set, recall_set) in pair_sequence_dataset:
 
 
                 study_paired_data, study_paired_target = convert_sequence_to_images(alphabet=alphabet, second_alphabet=alphabet,
                                                                        sequence=study_set, element='both',
-                                                                        main_labels=labels_study)
+                                                                        label_to_idx=label_to_idx)
                 if contiguous_images:
                     study_data, study_target = convert_sequence_to_images(alphabet=alphabet,
                                                                                         second_alphabet=alphabet_blur,
                                                                                         sequence=study_set,
                                                                                         element='both',
-                                                                                        main_labels=labels_study)
+                                                                                        label_to_idx=label_to_idx)
+                    study_data = study_data.to(device)
                     study_target = torch.tensor(study_target, dtype=torch.long, device=device)
                 else:
                     study_data_A, study_target = convert_sequence_to_images(alphabet=alphabet_blur,
                                                                               sequence=study_set, element='first',
-                                                                              main_labels=labels_study)
+                                                                              label_to_idx=label_to_idx)
                     study_target = torch.tensor(study_target, dtype=torch.long, device=device)
                     study_data_B, _ = convert_sequence_to_images(alphabet=alphabet,
                                                                               sequence=study_set, element='second',
-                                                                              main_labels=labels_study)
-                    _, study_data_A = model(study_data_A, study_target, mode='validate')
-                    _, study_data_B = model(study_data_B, study_target, mode='validate')
+                                                                              label_to_idx=label_to_idx)
+                    _, study_data_A = model(study_data_A.to(device, memory_format=memory_format), study_target, mode='validate')
+                    _, study_data_B = model(study_data_B.to(device, memory_format=memory_format), study_target, mode='validate')
                     study_data = study_data_A['ltm']['memory']['output'].detach() + study_data_B['ltm']['memory']['output'].detach()
 
-
-                study_data = study_data.to(device)
-                study_target = study_target.to(device)
-
                 if single_recall:
                     recall_data = single_characters.repeat(-(-batch_size//characters), 1, 1, 1)
                     recall_data = recall_data[0:batch_size]
@@ -289,44 +308,41 @@ def main():
                     del recall_target[batch_size:len(recall_target)]
                     recall_target = torch.tensor(recall_target, dtype=torch.long, device=device)
                     if not contiguous_images:
-                        _, recall_data = model(recall_data, recall_target, mode='validate')
+                        _, recall_data = model(recall_data.to(device, memory_format=memory_format), recall_target, mode='validate')
                         recall_data = recall_data['ltm']['memory']['output'].detach()
+                    else:
+                        recall_data = recall_data.to(device)
                 else:
 
                     recall_paired_data, recall_paired_target = convert_sequence_to_images(alphabet=alphabet_recall,
                                                                             second_alphabet=alphabet_recall,
                                                                             sequence=recall_set,
-                                                                            main_labels=labels_study,
+                                                                            label_to_idx=label_to_idx,
                                                                             delete_first=True, num_delete=characters)
                     recall_paired_data = torch.cat((single_characters, recall_paired_data), 0)
                     recall_paired_target = list(range(max(recall_paired_target) + 1, max(recall_paired_target) + 1 + characters)) + recall_paired_target
                     if contiguous_images:
-                        recall_data = recall_paired_data
-                        recall_target = recall_paired_target
+                        recall_data = recall_paired_data.to(device)
+                        recall_target = torch.tensor(recall_paired_target, dtype=torch.long, device=device)
                     else:
                         recall_data_A, recall_target = convert_sequence_to_images(alphabet=alphabet_recall,
                                                                                 sequence=recall_set, element='first',
-                                                                                main_labels=labels_study)
+                                                                                label_to_idx=label_to_idx)
                         recall_target = torch.tensor(recall_target, dtype=torch.long, device=device)
                         recall_data_B, _ = convert_sequence_to_images(alphabet=alphabet_recall,
                                                                      sequence=recall_set, element='second',
-                                                                     main_labels=labels_study)
-                        _, recall_data_A = model(recall_data_A, recall_target, mode='validate')
-                        _, recall_data_B = model(recall_data_B, recall_target, mode='validate')
+                                                                     label_to_idx=label_to_idx)
+                        _, recall_data_A = model(recall_data_A.to(device, memory_format=memory_format), recall_target, mode='validate')
+                        _, recall_data_B = model(recall_data_B.to(device, memory_format=memory_format), recall_target, mode='validate')
                         recall_data = recall_data_A['ltm']['memory']['output'].detach() + recall_data_B['ltm']['memory'][
                             'output'].detach()
 
-                recall_data = recall_data.to(device)
-                recall_target = torch.tensor(recall_target, dtype=torch.long, device=device)
-                recall_target = recall_target.to(device)
-
                 # Reset to saved model
                 model.reset()
 
                 # Study
                 # --------------------------------------------------------------------------
-                for step in range(config['settled_response_steps']):
-
+                def study_step(step):
                     if contiguous_images:
                         study_train_losses, _ = model(study_data, study_target, mode='study')
                         study_train_loss = study_train_losses['stm']['memory']['loss']
@@ -335,48 +351,57 @@ def main():
                                                       paired_inputs=study_paired_data)
                         study_train_loss = study_train_losses['stm']['memory']['loss']
 
-                    print('Losses batch {}, ite {}: \t PR:{:.6f}\
-                        PR mismatch: {:.6f} \t ca3_ca1: {:.6f}'.format(idx, step,
-                                                                     study_train_loss['pr'].item(),
-                                                                     study_train_loss['pr_mismatch'].item(),
-                                                                     study_train_loss['ca3_ca1'].item()))
-
-                    if step == (config['initial_response_step']-1) or step == (config['settled_response_steps']-1):
-                        with torch.no_grad():
-                            _, recall_outputs = model(recall_data, recall_target, mode='recall', ec_inputs=recall_data,
-                                                      paired_inputs=study_paired_data)
-                            cos = torch.nn.CosineSimilarity(dim=0, eps=1e-6)
-                            for component in components:
-                                #if component == 'ltm':
-                                #    recall_outputs_flat = torch.flatten(recall_outputs["ltm"]["memory"]["decoding"],
-                                #                                        start_dim=1)
-                                if component == 'dg':
-                                    recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component],
+                    if LOG_EVERY_EVAL > 0 and step % LOG_EVERY_EVAL == 0:
+                        print('Losses batch {}, ite {}: \t PR:{:.6f}\
+                            PR mismatch: {:.6f} \t ca3_ca1: {:.6f}'.format(idx, step,
+                                                                         study_train_loss['pr'].item(),
+                                                                         study_train_loss['pr_mismatch'].item(),
+                                                                         study_train_loss['ca3_ca1'].item()))
+
+                def recall_eval(step):
+                    with torch.no_grad(), utils.autocast(device, mixed_precision):
+                        _, recall_outputs = model(recall_data, recall_target, mode='recall', ec_inputs=recall_data,
+                                                  paired_inputs=study_paired_data)
+                        for component in components:
+                            #if component == 'ltm':
+                            #    recall_outputs_flat = torch.flatten(recall_outputs["ltm"]["memory"]["decoding"],
+                            #                                        start_dim=1)
+                            if component == 'dg':
+                                recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component],
+                                                                start_dim=1)
+                            if component == 'pr':
+                                recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component]['pr_out'],
                                                                     start_dim=1)
-                                if component == 'pr':
-                                    recall_outputs_flat = torch.flatten(recall_outputs["stm"]["memory"][component]['pr_out'],
-                                                                        start_dim=1)
-                                if component == 'ca3':
-                                    recall_outputs_flat = torch.flatten(
-                                        recall_outputs["stm"]["memory"][component],
-                                        start_dim=1)
-                                if component == 'ca3_ca1':
-                                    recall_outputs_flat = torch.flatten(
-                                        recall_outputs["stm"]["memory"][component]['decoding'],
-                                        start_dim=1)
-                                if component == 'final':
-                                    recall_outputs_flat = torch.flatten(
-                                        recall_outputs["stm"]["memory"]['decoding'],
-                                        start_dim=1)
-                                    similarity = [[cos(a, b) for b in main_pairs_flat.cpu()] for a in recall_outputs_flat.cpu()]
-                                    similarity_idx = [t.index(max(t)) for t in similarity]
-                                    predictions.extend([[labels_study[a] for a in similarity_idx]])
-
-                                recall_outputs_flat = recall_outputs_flat[0:characters].cpu()
-                                pearson_r = [[stats.pearsonr(a, b)[0] for a in recall_outputs_flat] for b in
-                                             recall_outputs_flat]
-                                pearson_r = torch.tensor(pearson_r)
-                                pearson_r_tensor[component] = torch.cat((pearson_r_tensor[component], pearson_r[None, :, :]), 0)
+                            if component == 'ca3':
+                                recall_outputs_flat = torch.flatten(
+                                    recall_outputs["stm"]["memory"][component],
+                                    start_dim=1)
+                            if component == 'ca3_ca1':
+                                recall_outputs_flat = torch.flatten(
+                                    recall_outputs["stm"]["memory"][component]['decoding'],
+                                    start_dim=1)
+                            if component == 'final':
+                                recall_outputs_flat = torch.flatten(
+                                    recall_outputs["stm"]["memory"]['decoding'],
+                                    start_dim=1)
+                                recall_outputs_unit = F.normalize(recall_outputs_flat.to(device), dim=1, eps=1e-6)
+                                similarity = recall_outputs_unit @ main_pairs_unit.T
+                                similarity_idx = similarity.argmax(dim=1).tolist()
+                                predictions.extend([[labels_study[a] for a in similarity_idx]])
+
+                            recall_outputs_flat = recall_outputs_flat[0:characters]
+                            pearson_r = utils.pearson_correlation_matrix(recall_outputs_flat, recall_outputs_flat).cpu()
+                            pearson_r_tensor[component].append(pearson_r)
+
+                # Train up to, then recall after, the initial and the settled response steps
+                recall_steps = sorted({s for s in (config['initial_response_step'] - 1, config['settled_response_steps'] - 1)
+                                       if 0 <= s < config['settled_response_steps']})
+                next_step = 0
+                for recall_step in recall_steps:
+                    for step in range(next_step, recall_step + 1):
+                        study_step(step)
+                    recall_eval(recall_step)
+                    next_step = recall_step + 1
 
                 pairs_inputs.extend([[(int(a[0]), int(a[1])) for a in study_set]])
 
@@ -384,6 +409,7 @@ def main():
                 # Recall
                 # --------------------------------------------------------------------------
                 with torch.no_grad():
+                    features = utils.features_to_host(model.features)
 
                     if 'metrics' in config and config['metrics']:
                         metrics_config = config['metrics']
@@ -392,11 +418,11 @@ def main():
                         assert all(x == metrics_len[0] for x in metrics_len), 'Mismatch in metrics config'
 
                         for i in range(metrics_len[0]):
-                            primary_feature = utils.find_json_value(metrics_config['primary_feature_names'][i], model.features)
-                            primary_label = utils.find_json_value(metrics_config['primary_label_names'][i], model.features)
+                            primary_feature = utils.find_json_value(metrics_config['primary_feature_names'][i], features)
+                            primary_label = utils.find_json_value(metrics_config['primary_label_names'][i], features)
                             secondary_feature = utils.find_json_value(metrics_config['secondary_feature_names'][i],
-                                                                      model.features)
-                            secondary_label = utils.find_json_value(metrics_config['secondary_label_names'][i], model.features)
+                                                                      features)
+                            secondary_label = utils.find_json_value(metrics_config['secondary_label_names'][i], features)
                             comparison_type = metrics_config['comparison_types'][i]
                             prefix = metrics_config['prefixes'][i]
 
@@ -407,89 +433,98 @@ def main():
 
                     # PR Accuracy (study first) - this is the version used in the paper
                     oneshot_metrics.compare(prefix='pr_sf_',
-                                            primary_features=model.features['study']['stm_pr'],
-                                            primary_labels=model.features['study']['labels'],
-                                            secondary_features=model.features['recall']['stm_pr'],
-                                            secondary_labels=model.features['recall']['labels'],
+                                            primary_features=features['study']['stm_pr'],
+                                            primary_labels=features['study']['labels'],
+                                            secondary_features=features['recall']['stm_pr'],
+                                            secondary_labels=features['recall']['labels'],
                                             comparison_type='match_mse')
 
                     # oneshot_metrics.compare(prefix='pr_rf_',
-                    #                         primary_features=model.features['recall']['stm_pr'],
-                    #                         primary_labels=model.features['recall']['labels'],
-                    #                         secondary_features=model.features['study']['stm_pr'],
-                    #                         secondary_labels=model.features['study']['labels'],
+                    #                         primary_features=features['recall']['stm_pr'],
+                    #                         primary_labels=features['recall']['labels'],
+                    #                         secondary_features=features['study']['stm_pr'],
+                    #                         secondary_labels=features['study']['labels'],
                     #                         comparison_type='match_mse')
 
                     oneshot_metrics.report()
 
-                    summary_names = [
-                        'study_inputs',
-                        'study_stm_pr',
-                        'study_stm_ca3',
+                    if idx % summary_every == 0:
+                        summary_names = [
+                            'study_inputs',
+                            'study_stm_pr',
+                            'study_stm_ca3',
 
-                        'recall_inputs',
-                        'recall_stm_pr',
-                        'recall_stm_ca3',
-                        'recall_stm_recon'
-                    ]
+                            'recall_inputs',
+                            'recall_stm_pr',
+                            'recall_stm_ca3',
+                            'recall_stm_recon'
+                        ]
 
-                    summary_images = []
-                    for name in summary_names:
-                        mode_key, feature_key = name.split('_', 1)
+                        summary_images = []
+                        for name in summary_names:
+                            mode_key, feature_key = name.split('_', 1)
 
-                        summary_features = model.features[mode_key][feature_key]
-                        if len(summary_features.shape) > 2:
-                            summary_features = summary_features.permute(0, 2, 3, 1)
+                            summary_features = features[mode_key][feature_key]
+                            if len(summary_features.shape) > 2:
+                                summary_features = summary_features.permute(0, 2, 3, 1)
 
-                        summary_shape, _ = utils.square_image_shape_from_1d(np.prod(summary_features.data.shape[1:]))
-                        summary_shape[0] = summary_features.data.shape[0]
+                            summary_shape, _ = utils.square_image_shape_from_1d(np.prod(summary_features.data.shape[1:]))
+                            summary_shape[0] = summary_features.data.shape[0]
 
-                        summary_image = (name, summary_features, summary_shape)
-                        summary_images.append(summary_image)
+                            summary_image = (name, summary_features, summary_shape)
+                            summary_images.append(summary_image)
 
-                    utils.add_completion_summary(summary_images, summary_dir, idx, save_figs=True)
+                        utils.add_completion_summary(summary_images, summary_dir, idx, save_figs=True)
 
             # Save results
             predictions_initial = predictions[0:config['settled_response_steps']:2]
             predictions_settled = predictions[1:config['settled_response_steps']:2]
-            pearson_r_initial = {a: pearson_r_tensor[a][1:config['settled_response_steps']:2] for a in pearson_r_tensor}
-            pearson_r_settled = {a: pearson_r_tensor[a][2:config['settled_response_steps']+1:2] for a in pearson_r_tensor}
+            pearson_r_tensor = {a: torch.stack(pearson_r_tensor[a], 0) for a in pearson_r_tensor}
+            pearson_r_initial = {a: pearson_r_tensor[a][0:config['settled_response_steps']-1:2] for a in pearson_r_tensor}
+            pearson_r_settled = {a: pearson_r_tensor[a][1:config['settled_response_steps']:2] for a in pearson_r_tensor}
             pearson_r_initial = {a: torch.mean(pearson_r_initial[a], 0) for a in pearson_r_initial}
             pearson_r_settled = {a: torch.mean(pearson_r_settled[a], 0) for a in pearson_r_settled}
 
 
-            with open(main_summary_dir + '/predictions_initial'+ str(stm_epoch) + '_'+ str(seed) + '.csv', 'w', encoding='UTF8') as f:
-                writer_file = csv.writer(f)
-                writer_file.writerows(predictions_initial)
-
-            with open(main_summary_dir + '/predictions_settled'+ str(stm_epoch)+ '_' +str(seed)+'.csv', 'w', encoding='UTF8') as f:
-                writer_file = csv.writer(f)
-                writer_file.writerows(predictions_settled)
-
-            with open(main_summary_dir + '/pair_inputs' + str(stm_epoch) + '_' + str(
-                    seed) + '.csv', 'w', encoding='UTF8') as f:
-                writer_file = csv.writer(f)
-                writer_file.writerows(pairs_inputs)
-
             if mirror:
                 tag = 'mirror'
             else:
                 tag = ''
 
-            for a in pearson_r_initial.keys():
-                with open(main_summary_dir + '/pearson_initial_' + a + '_' + str(stm_epoch) + '_'+ str(seed) + tag + '.csv', 'w', encoding='UTF8') as f:
+            np.savez_compressed(main_summary_dir + '/results_' + str(stm_epoch) + '_' + str(seed) + tag + '.npz',
+                                predictions_initial=utils.concat_pairs(predictions_initial),
+                                predictions_settled=utils.concat_pairs(predictions_settled),
+                                pair_inputs=utils.concat_pairs(pairs_inputs),
+                                **{'pearson_initial_' + a: v.numpy() for a, v in pearson_r_initial.items()},
+                                **{'pearson_settled_' + a: v.numpy() for a, v in pearson_r_settled.items()})
+
+            if args.csv:
+                with open(main_summary_dir + '/predictions_initial'+ str(stm_epoch) + '_'+ str(seed) + '.csv', 'w', encoding='UTF8') as f:
+                    writer_file = csv.writer(f)
+                    writer_file.writerows(predictions_initial)
+
+                with open(main_summary_dir + '/predictions_settled'+ str(stm_epoch)+ '_' +str(seed)+'.csv', 'w', encoding='UTF8') as f:
                     writer_file = csv.writer(f)
-                    writer_file.writerows(pearson_r_initial[a].numpy())
+                    writer_file.writerows(predictions_settled)
 
-            for a in pearson_r_settled.keys():
-                with open(main_summary_dir + '/pearson_settled_' + a + '_' + str(stm_epoch) + '_' + str(seed) + tag + '.csv', 'w', encoding='UTF8') as f:
+                with open(main_summary_dir + '/pair_inputs' + str(stm_epoch) + '_' + str(
+                        seed) + '.csv', 'w', encoding='UTF8') as f:
                     writer_file = csv.writer(f)
-                    writer_file.writerows(pearson_r_settled[a].numpy())
+                    writer_file.writerows(pairs_inputs)
+
+                for a in pearson_r_initial.keys():
+                    np.savetxt(main_summary_dir + '/pearson_initial_' + a + '_' + str(stm_epoch) + '_'+ str(seed) + tag + '.csv',
+                               pearson_r_initial[a].numpy(), fmt='%.9g', delimiter=',', encoding='UTF8')
+
+                for a in pearson_r_settled.keys():
+                    np.savetxt(main_summary_dir + '/pearson_settled_' + a + '_' + str(stm_epoch) + '_' + str(seed) + tag + '.csv',
+                               pearson_r_settled[a].numpy(), fmt='%.9g', delimiter=',', encoding='UTF8')
 
-            oneshot_metrics.report_averages()
             writer.flush()
             writer.close()
 
+        oneshot_metrics.report_averages()
+
     # for a in pearson_r_initial.keys():
     #     heatmap_initial = HeatmapPlotter(main_summary_dir, "pearson_initial_" + a)
     #     heatmap_settled = HeatmapPlotter(main_summary_dir, "pearson_settled_" + a)
@@ -511,8 +546,25 @@ def add_empty_character(images, mirror=False, double=False):
     return data
 
 
-def convert_sequence_to_images(alphabet, sequence, main_labels, element='first', second_alphabet=None,
+def convert_sequence_to_images(alphabet, sequence, label_to_idx, element='first', second_alphabet=None,
                                delete_first=False, num_delete=0):
+    if isinstance(alphabet, OmniglotAlphabetBank) and \
+            (element != 'both' or isinstance(second_alphabet, OmniglotAlphabetBank)):
+        sequence = torch.as_tensor(sequence).long()
+        if delete_first:
+            sequence = sequence[num_delete:]
+        images_first, labels_first = alphabet[sequence[:, 0]]
+        images_second, labels_second = alphabet[sequence[:, 1]]
+        if element == 'both':
+            pairs_images = torch.cat((second_alphabet[sequence[:, 0]][0], images_second), 3)
+        if element == 'first':
+            pairs_images = images_first
+        if element == 'second':
+            pairs_images = images_second
+        labels = list(zip(labels_first, labels_second))
+        labels = [label_to_idx[value] for value in labels]
+        return pairs_images, labels
+
     if element == 'both':
         pairs_images = [torch.cat((second_alphabet[int(a[0])][0], alphabet[int(a[1])][0]), 2) for a in sequence]
     if element == 'first':
@@ -520,7 +572,7 @@ def convert_sequence_to_images(alphabet, sequence, main_labels, element='first',
     if element == 'second':
         pairs_images = [alphabet[int(a[1])][0] for a in sequence]
     labels = [(alphabet[int(a[0])][1], alphabet[int(a[1])][1]) for a in sequence]
-    labels = [main_labels.index(value) for value in labels]
+    labels = [label_to_idx[value] for value in labels]
     if delete_first:
         del pairs_images[0:num_delete]
     pairs_images = torch.stack(pairs_images, 0)
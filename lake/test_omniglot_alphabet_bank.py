@@ -0,0 +1,99 @@
+"""test_omniglot_alphabet_bank.py"""
+
+import os
+import tempfile
+
+import numpy as np
+import torch
+import imageio
+from torchvision import transforms
+
+from datasets.omniglot_one_shot_dataset import OmniglotTransformation
+from datasets.omniglot_per_alphabet_dataset import OmniglotAlphabet, OmniglotAlphabetBank, bank_alphabet
+
+ALPHABET = 'Test_alphabet'
+NUM_CHARACTERS = 3
+NUM_WRITERS = 20  # Alphabets with `variation` sample from 20 writers
+
+
+def make_own_alphabet(root):
+  """Write a small random alphabet in the `own_alphabets` layout read by OmniglotAlphabet."""
+  rng = np.random.RandomState(0)
+  for c in range(NUM_CHARACTERS):
+    character_dir = os.path.join(root, 'own_alphabets', ALPHABET, 'character{:02d}'.format(c + 1))
+    os.makedirs(character_dir)
+    for w in range(NUM_WRITERS):
+      image = (rng.rand(20, 20) > 0.7).astype(np.uint8) * 255
+      imageio.imwrite(os.path.join(character_dir, '{:02d}.png'.format(w + 1)), image)
+
+
+def make_alphabet(root, resize_factor=0.5, variation=False):
+  image_tfms = transforms.Compose([
+      transforms.ToTensor(),
+      OmniglotTransformation(resize_factor=resize_factor)])
+  return OmniglotAlphabet(root, ALPHABET, True, own_alphabet=True, variation=variation, writer_idx=1,
+                          transform=image_tfms, target_transform=None)
+
+
+def test_bank_matches_alphabet():
+  with tempfile.TemporaryDirectory() as root:
+    make_own_alphabet(root)
+    alphabet = make_alphabet(root)
+
+    bank = OmniglotAlphabetBank(alphabet, cache_key=0.5)
+    cached_bank = OmniglotAlphabetBank(alphabet, cache_key=0.5)
+    assert os.path.exists(bank.cache_path)
+    assert len(bank) == len(cached_bank) == len(alphabet) == NUM_CHARACTERS
+
+    for idx in range(len(alphabet)):
+      image, label = alphabet[idx]
+      for banked in (bank, cached_bank):
+        banked_image, banked_label = banked[idx]
+        assert torch.equal(banked_image, image)
+        assert banked_label == label
+
+
+def test_cache_key_follows_transform():
+  with tempfile.TemporaryDirectory() as root:
+    make_own_alphabet(root)
+
+    half = OmniglotAlphabetBank(make_alphabet(root, resize_factor=0.5), cache_key=0)
+    same = OmniglotAlphabetBank(make_alphabet(root, resize_factor=0.5), cache_key=0)
+    full = OmniglotAlphabetBank(make_alphabet(root, resize_factor=1.0), cache_key=0)
+
+    assert half.cache_path == same.cache_path
+    assert half.cache_path != full.cache_path
+    assert half.images.shape[-1] * 2 == full.images.shape[-1]
+
+
+def test_cache_key_follows_image_files():
+  with tempfile.TemporaryDirectory() as root:
+    make_own_alphabet(root)
+    alphabet = make_alphabet(root)
+    before = OmniglotAlphabetBank(alphabet, cache_key=0.5)
+
+    # Touch one of the images the alphabet reads
+    image_name, character_class = alphabet.flat_character_images[0]
+    image_path = os.path.join(alphabet.target_folder, alphabet.characters[character_class], image_name)
+    mtime = os.path.getmtime(image_path)
+    os.utime(image_path, (mtime + 10, mtime + 10))
+
+    after = OmniglotAlphabetBank(alphabet, cache_key=0.5)
+    assert before.cache_path != after.cache_path
+
+
+def test_variation_alphabet_is_not_banked():
+  with tempfile.TemporaryDirectory() as root:
+    make_own_alphabet(root)
+    alphabet = make_alphabet(root, variation=True)
+
+    assert bank_alphabet(alphabet, cache_key=0.5) is alphabet
+    assert not os.path.exists(os.path.join(root, '_cache'))
+
+
+if __name__ == '__main__':
+  test_bank_matches_alphabet()
+  test_cache_key_follows_transform()
+  test_cache_key_follows_image_files()
+  test_variation_alphabet_is_not_banked()
+  print('OK')
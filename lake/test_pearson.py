@@ -0,0 +1,54 @@
+"""test_pearson.py"""
+
+import numpy as np
+import torch
+from scipy import stats
+
+import utils
+
+
+def test_matches_scipy_pearsonr():
+  torch.manual_seed(0)
+  a = torch.rand(6, 3, 4, 4)
+  b = torch.rand(5, 3, 4, 4)
+
+  matrix = utils.pearson_correlation_matrix(a, b)
+  assert matrix.shape == (6, 5)
+  assert matrix.dtype == torch.float32
+
+  a_flat = a.flatten(start_dim=1).numpy()
+  b_flat = b.flatten(start_dim=1).numpy()
+  expected = np.array([[stats.pearsonr(x, y)[0] for y in b_flat] for x in a_flat])
+  np.testing.assert_allclose(matrix.numpy(), expected, atol=1e-6)
+
+
+def test_identical_rows_are_clamped_to_one():
+  torch.manual_seed(1)
+  a = torch.rand(4, 50) * 1e3
+
+  matrix = utils.pearson_correlation_matrix(a, a)
+  assert torch.all(matrix <= 1.0) and torch.all(matrix >= -1.0)
+  np.testing.assert_allclose(torch.diagonal(matrix).numpy(), np.ones(4), atol=1e-6)
+
+
+def test_constant_row_gives_nan():
+  torch.manual_seed(2)
+  a = torch.rand(3, 20)
+  a[1] = 0.5
+  b = torch.rand(2, 20)
+
+  matrix = utils.pearson_correlation_matrix(a, b)
+
+  # scipy also returns NaN (with a warning) when an input is constant
+  with np.errstate(invalid='ignore', divide='ignore'):
+    expected = np.array([[stats.pearsonr(x, y)[0] for y in b.numpy()] for x in a.numpy()])
+  assert np.isnan(expected[1]).all()
+  assert torch.isnan(matrix[1]).all()
+  np.testing.assert_allclose(matrix[[0, 2]].numpy(), expected[[0, 2]], atol=1e-6)
+
+
+if __name__ == '__main__':
+  test_matches_scipy_pearsonr()
+  test_identical_rows_are_clamped_to_one()
+  test_constant_row_gives_nan()
+  print('OK')
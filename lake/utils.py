@@ -1,7 +1,11 @@
 """lake/utils.py"""
 
 import os
+import re
+import glob
 import math
+import contextlib
+import functools
 import random
 import datetime
 
@@ -31,6 +35,104 @@ def set_seed(seed):
   torch.manual_seed(seed)
 
 
+def inference_mode():
+  """Disable autograd, preferring `torch.inference_mode` when the installed PyTorch provides it."""
+  if hasattr(torch, 'inference_mode'):
+    return torch.inference_mode()
+  return torch.no_grad()
+
+
+def autocast(device, enabled=True):
+  """
+  Run CUDA ops in float16 where safe, preferring `torch.autocast` and falling back to `torch.cuda.amp`.
+  Only meant for forward-only passes (validation and recall): CLS.forward runs its own backward and optimiser
+  steps, so training can't be given a gradient scaler and stays in float32.
+  """
+  if not enabled or device.type != 'cuda':
+    return contextlib.nullcontext()
+  if hasattr(torch, 'autocast'):
+    return torch.autocast(device_type='cuda', dtype=torch.float16)
+  return torch.cuda.amp.autocast()
+
+
+def maybe_compile(model, config):
+  """Compile `model` in-place when the config sets `compile_model` and PyTorch supports it (2.2+)."""
+  # CLS.forward steps its own optimisers, so the default mode is used rather than CUDA graphs
+  if config.get('compile_model', False) and hasattr(model, 'compile'):
+    model.compile(dynamic=False)
+  return model
+
+
+CHECKPOINT_PATTERN = re.compile(r'^pretrained_model_(\d+)\.pt$')
+
+
+def find_checkpoints(folder):
+  """Return the `pretrained_model_<epoch>.pt` files in `folder` as (epoch, path) pairs, oldest epoch first."""
+  checkpoints = []
+  for filename in os.listdir(folder):
+    match = CHECKPOINT_PATTERN.match(filename)
+    if match:
+      checkpoints.append((int(match.group(1)), os.path.join(folder, filename)))
+  return sorted(checkpoints)
+
+
+def latest_checkpoint(folder):
+  """Return the path of the highest-epoch checkpoint in `folder`, and its epoch."""
+  checkpoints = find_checkpoints(folder)
+  if not checkpoints:
+    raise FileNotFoundError('No pretrained_model_<epoch>.pt checkpoint found in: ' + folder)
+  epoch, path = checkpoints[-1]
+  return path, epoch
+
+
+def should_checkpoint(epoch, config):
+  """Checkpoint every `save_every` epochs (by default a fifth of `pretrain_epochs`) and always after the final one."""
+  save_every = config.get('save_every', max(1, config['pretrain_epochs'] // 5))
+  return epoch % save_every == 0 or epoch == config['pretrain_epochs']
+
+
+def save_checkpoint(model, folder, epoch, keep_last=1):
+  """Atomically write `pretrained_model_<epoch>.pt` to `folder` and delete all but the newest `keep_last`."""
+  os.makedirs(folder, exist_ok=True)
+  model_path = os.path.join(folder, 'pretrained_model_' + str(epoch) + '.pt')
+  tmp_path = model_path + '.tmp'
+  torch.save(model.state_dict(), tmp_path)
+  os.replace(tmp_path, model_path)
+
+  # Remove older checkpoints, and any temporary files left behind by an interrupted save
+  stale_paths = [path for _, path in find_checkpoints(folder)[:-keep_last]]
+  stale_paths += glob.glob(os.path.join(folder, 'pretrained_model_*.pt.tmp'))
+  for stale_path in stale_paths:
+    os.remove(stale_path)
+
+  return model_path
+
+
+def concat_pairs(batches):
+  """Concatenate per-batch lists of (i, j) label pairs into a single (N, 2) integer array, whatever the batch sizes."""
+  if not batches:
+    return np.empty((0, 2), dtype=np.int64)
+  return np.concatenate([np.asarray(batch, dtype=np.int64).reshape(-1, 2) for batch in batches], 0)
+
+
+def features_to_host(features):
+  """Copy the tensors in a (nested) feature dict to the host, waiting on the current CUDA stream once for all of them."""
+  copied_from_cuda = []
+
+  def to_host(value):
+    if isinstance(value, dict):
+      return {key: to_host(item) for key, item in value.items()}
+    if torch.is_tensor(value) and value.is_cuda:
+      copied_from_cuda.append(value.device)
+      return value.to('cpu', non_blocking=True)
+    return value
+
+  host_features = to_host(features)
+  for device in set(copied_from_cuda):
+    torch.cuda.current_stream(device).synchronize()
+  return host_features
+
+
 def find_json_value(key_path, json, delimiter='.'):
   paths = key_path.split(delimiter)
   data = json
@@ -50,6 +152,23 @@ def overlap_match(a, b):
   return torch.sum(a*b)
 
 
+def pearson_correlation_matrix(a, b):
+  """
+  Pearson correlation between every row of `a` and every row of `b`, i.e. matrix[i, j] = r(a[i], b[j]).
+  Computed as one matrix product in float64; rows with zero variance give NaN, as `scipy.stats.pearsonr` does.
+  """
+  a = torch.flatten(a, start_dim=1).double()
+  b = torch.flatten(b, start_dim=1).double()
+
+  a = a - a.mean(dim=1, keepdim=True)
+  b = b - b.mean(dim=1, keepdim=True)
+
+  a = a / a.norm(dim=1, keepdim=True)
+  b = b / b.norm(dim=1, keepdim=True)
+
+  return torch.clamp(a @ b.T, -1.0, 1.0).float()
+
+
 def compute_matrix_prep(primary_features, secondary_features):
   primary_ftrs = primary_features  # shape = [num labels, feature_size]
   secondary_ftrs = secondary_features  # shape = [num labels, feature_size]
@@ -270,6 +389,16 @@ def square_image_shape_from_1d(filters):
   Make 1d tensor as square as possible. If the length is a prime, the worst case, it will remain 1d.
   Assumes and retains first dimension as batches.
   """
+  height, width, lost_pixels = _square_factors(int(filters))
+
+  shape = [-1, height, width, 1]
+
+  return shape, lost_pixels
+
+
+@functools.lru_cache(maxsize=16)
+def _square_factors(filters):
+  """Cached factorisation behind `square_image_shape_from_1d`, the same few feature sizes recur every batch."""
   height = int(math.sqrt(filters))
 
   while height > 1:
@@ -283,6 +412,4 @@ def square_image_shape_from_1d(filters):
   area = height * width
   lost_pixels = filters - area
 
-  shape = [-1, height, width, 1]
-
-  return shape, lost_pixels
+  return height, width, lost_pixels